@@ -0,0 +1,233 @@
+from fastapi import WebSocket, status
+from sqlalchemy import insert, select, func, text
+from sqlalchemy.engine import Engine
+from typing import Dict, List
+from datetime import datetime
+import asyncio
+import logging
+import json
+import time
+from . import models
+from .config import settings
+from .database import SessionLocal, AsyncSessionLocal
+from .pubsub import PubSubBackend, get_pubsub_backend
+
+
+def ensure_chat_schema(engine: Engine):
+    # create_all skips tables that already exist, so older databases get the history index here
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_event_id_timestamp_id ON messages (event_id, timestamp, id)"))
+
+
+class ConnectionManager:
+    def __init__(self, backend: PubSubBackend, max_queue_size: int = settings.chat_queue_size, slow_consumer_policy: str = settings.chat_slow_consumer_policy):
+        # Messages go out through the pub/sub backend and come back via deliver(),
+        # so rooms stay whole when chat is spread over several workers
+        self.backend = backend
+        # event_id -> {websocket: outbound queue}
+        self.rooms: Dict[int, Dict[WebSocket, asyncio.Queue]] = {}
+        self.subscribed_events = set()
+        self.subscription_lock = None  # created on first use, inside the running loop
+        self.senders: Dict[WebSocket, asyncio.Task] = {}
+        self.max_queue_size = max_queue_size
+        # "drop" discards the oldest queued frame, "disconnect" closes the socket
+        self.slow_consumer_policy = slow_consumer_policy
+        self.dropped_messages = 0
+        self.slow_consumers_disconnected = 0
+
+    async def connect(self, websocket: WebSocket, event_id: int):
+        await websocket.accept()
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.rooms.setdefault(event_id, {})[websocket] = queue
+        self.senders[websocket] = asyncio.create_task(self._sender(websocket, event_id, queue))
+        await self._sync_subscription(event_id)
+        logging.info(f"WebSocket connected: {websocket.client} to event {event_id}")
+
+    def disconnect(self, websocket: WebSocket, event_id: int):
+        room = self.rooms.get(event_id)
+        if room is not None and websocket in room:
+            del room[websocket]
+            if not room:
+                del self.rooms[event_id]
+                asyncio.create_task(self._sync_subscription(event_id))
+            logging.info(f"WebSocket disconnected: {websocket.client} from event {event_id}")
+        sender = self.senders.pop(websocket, None)
+        if sender is not None and sender is not asyncio.current_task():
+            sender.cancel()
+
+    async def _sync_subscription(self, event_id: int):
+        # Subscribe once per event while it has local sockets, unsubscribe when the room empties
+        if self.subscription_lock is None:
+            self.subscription_lock = asyncio.Lock()
+        async with self.subscription_lock:
+            if event_id in self.rooms and event_id not in self.subscribed_events:
+                await self.backend.subscribe(event_id, self.deliver)
+                self.subscribed_events.add(event_id)
+            elif event_id not in self.rooms and event_id in self.subscribed_events:
+                await self.backend.unsubscribe(event_id)
+                self.subscribed_events.discard(event_id)
+
+    async def _sender(self, websocket: WebSocket, event_id: int, queue: asyncio.Queue):
+        # One task per socket so a slow client only ever stalls its own queue
+        try:
+            while True:
+                message_json = await queue.get()
+                await websocket.send_text(message_json)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.error(f"Failed to send message to {websocket.client}: {e}")
+            self.disconnect(websocket, event_id)
+
+    async def _close_slow_consumer(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        except Exception as e:
+            logging.error(f"Failed to close slow consumer {websocket.client}: {e}")
+
+    async def broadcast(self, event_id: int, message: dict):
+        await self.backend.publish(event_id, json.dumps(message))
+
+    def deliver(self, event_id: int, message_json: str):
+        room = self.rooms.get(event_id, {})
+        for connection, queue in list(room.items()):
+            try:
+                queue.put_nowait(message_json)
+            except asyncio.QueueFull:
+                if self.slow_consumer_policy == "drop":
+                    queue.get_nowait()
+                    queue.put_nowait(message_json)
+                    self.dropped_messages += 1
+                else:
+                    logging.warning(f"Disconnecting slow consumer {connection.client} in event {event_id}")
+                    self.disconnect(connection, event_id)
+                    self.slow_consumers_disconnected += 1
+                    asyncio.create_task(self._close_slow_consumer(connection))
+
+    def stats(self):
+        return {
+            "rooms": {
+                event_id: {
+                    "connections": len(room),
+                    "queue_depths": [queue.qsize() for queue in room.values()],
+                }
+                for event_id, room in self.rooms.items()
+            },
+            "total_connections": sum(len(room) for room in self.rooms.values()),
+            "pubsub_backend": self.backend.name,
+            "subscribed_events": sorted(self.subscribed_events),
+            "max_queue_size": self.max_queue_size,
+            "slow_consumer_policy": self.slow_consumer_policy,
+            "dropped_messages": self.dropped_messages,
+            "slow_consumers_disconnected": self.slow_consumers_disconnected,
+        }
+
+
+class MessageWriter:
+    # Write-behind persistence for chat messages: the WebSocket loop only enqueues,
+    # a background task flushes multi-row INSERTs by batch size or time window.
+    # Ids come from the messages sequence before the broadcast, so live frames carry
+    # the same id the row gets and clients can dedup and resume on it.
+    def __init__(self, session_factory=SessionLocal, async_session_factory=AsyncSessionLocal, batch_size: int = settings.chat_flush_batch_size, flush_interval_ms: int = settings.chat_flush_interval_ms, max_pending: int = settings.chat_max_pending_messages):
+        self.session_factory = session_factory
+        self.async_session_factory = async_session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.queue = None
+        self.task = None
+        self.messages_written = 0
+        self.messages_failed = 0
+        self.batches_flushed = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # The sentinel queues up behind every pending message, so stopping drains first
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+    async def next_id(self) -> int:
+        # nextval never takes a lock or waits for other transactions
+        async with self.async_session_factory() as db:
+            return await db.scalar(select(func.nextval("messages_id_seq")))
+
+    async def enqueue(self, message_id: int, event_id: int, user_id: int, content: str, timestamp: datetime):
+        # Blocks only the calling socket when the writer falls max_pending messages behind
+        await self.queue.put({"id": message_id, "event_id": event_id, "user_id": user_id, "content": content, "timestamp": timestamp})
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self.queue.get()
+            if row is None:
+                break
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[dict]):
+        started = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+            self.messages_written += len(batch)
+        except Exception as e:
+            logging.error(f"Failed to persist {len(batch)} chat messages: {e}")
+            self.messages_failed += len(batch)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.batches_flushed += 1
+        self.last_batch_size = len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def _write(self, batch: List[dict]):
+        db = self.session_factory()
+        try:
+            db.execute(insert(models.Message).values(batch))
+            db.commit()
+        finally:
+            db.close()
+
+    def stats(self):
+        batches = self.batches_flushed or 1
+        return {
+            "pending_messages": self.queue.qsize() if self.queue is not None else 0,
+            "messages_written": self.messages_written,
+            "messages_failed": self.messages_failed,
+            "batches_flushed": self.batches_flushed,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": (self.messages_written + self.messages_failed) / batches,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / batches,
+        }
+
+
+manager = ConnectionManager(get_pubsub_backend())
+message_writer = MessageWriter()
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import Optional
 
 
 class Settings(BaseSettings):
@@ -11,6 +12,74 @@ class Settings(BaseSettings):
     algorithm : str
     access_token_expire_minutes : int
     base_url: str
+
+    # Database connection pools (per engine, per worker)
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 10  # seconds to wait for a free connection before failing
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_timeout_ms: int = 30000  # 0 disables
+    db_pgbouncer: bool = False  # running behind PgBouncer in transaction pooling mode
+
+    # Events feed
+    events_page_size: int = 20
+    fragment_cache_size: int = 2000
+    fragment_cache_ttl_seconds: int = 300
+
+    # Invitations
+    invitable_users_page_size: int = 50
+    user_search_limit: int = 10
+
+    # Response compression
+    compression_minimum_size: int = 500  # bytes; smaller bodies are sent as is
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 5  # used when the brotli package is installed
+
+    # Uploaded pictures
+    upload_max_bytes: int = 10 * 1024 * 1024
+    thumbnail_workers: int = 2
+    media_backend: str = "local"
+    media_root: str = "static/media"  # served with immutable caching under /static/media
+    media_gc_grace_seconds: int = 3600  # unreferenced blobs younger than this are kept
+
+    # Background NER tagging
+    tagging_workers: int = 1
+    tagging_batch_size: int = 16
+    tagging_batch_window_ms: int = 500
+    tagging_service_url: Optional[str] = None  # e.g. http://localhost:8001 to share one model between workers
+    tagging_claim_seconds: int = 600  # pending events claimed by a worker that died are re-queued after this
+    tag_cache_size: int = 1024
+    tag_cache_ttl_seconds: int = 86400
+    tag_cache_persistent: bool = True
+
+    # Chat fan-out
+    chat_queue_size: int = 100
+    chat_slow_consumer_policy: str = "disconnect"
+    chat_pubsub_backend: str = "memory"  # "memory" or "postgres"
+    chat_flush_batch_size: int = 100
+    chat_flush_interval_ms: int = 200
+    chat_max_pending_messages: int = 10000
+
+    # Live feed updates (SSE)
+    live_updates_backend: str = "memory"  # "postgres" to reach feeds open on other workers
+    live_updates_queue_size: int = 100
+    live_updates_keepalive_seconds: int = 15
+
+    # Access tokens
+    token_backend: str = "jose"  # "jose", "pyjwt" or "hmac"
+    token_cache_size: int = 10000
+    token_cache_ttl_seconds: int = 300
+
+    # Password hashing
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 16
+
+    # Authenticated-user cache
+    user_cache_size: int = 10000
+    user_cache_ttl_seconds: int = 300
+    user_cache_invalidation_backend: str = "memory"  # "postgres" to invalidate across workers via LISTEN/NOTIFY
     
     #class Config:
         #env_file = ".env"
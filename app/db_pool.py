@@ -0,0 +1,122 @@
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, QueuePool
+import threading
+import time
+from .config import settings
+
+# Pool configuration for the sync and async engines, plus instrumentation to size it:
+# how long requests wait for a connection, how full the pool is, and how often
+# connections are opened and closed.
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.connections_invalidated = 0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def instrument(self, engine):
+        # Pool events registered on the engine survive pool recreation (engine.dispose())
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "close", self._on_close)
+        event.listen(engine, "close_detached", self._on_close)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connections_opened += 1
+
+    def _on_close(self, dbapi_connection, *args):
+        with self.lock:
+            self.connections_closed += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.connections_invalidated += 1
+
+    def stats(self, pool):
+        with self.lock:
+            stats = {
+                "pool": type(pool).__name__,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": self.total_wait_seconds / self.checkouts * 1000 if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait_seconds * 1000,
+                "connections_opened": self.connections_opened,
+                "connections_closed": self.connections_closed,
+                "connections_invalidated": self.connections_invalidated,
+            }
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + pool._max_overflow
+            stats.update({
+                "size": pool.size(),
+                "max_overflow": pool._max_overflow,
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "saturation": pool.checkedout() / capacity if capacity > 0 else 0.0,
+            })
+        return stats
+
+
+def timed_pool_class(base, metrics: PoolMetrics):
+    # _do_get is where a pool blocks for a free connection (or opens a new one)
+    class TimedPool(base):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except exc.TimeoutError:
+                metrics.record_wait(time.perf_counter() - started, timed_out=True)
+                raise
+            metrics.record_wait(time.perf_counter() - started)
+            return connection
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def engine_options(base_pool, metrics: PoolMetrics):
+    options = {"pool_pre_ping": settings.db_pool_pre_ping}
+    if settings.db_pgbouncer:
+        # PgBouncer already pools server connections; holding a second pool here only pins them
+        options["poolclass"] = timed_pool_class(NullPool, metrics)
+        return options
+    options.update({
+        "poolclass": timed_pool_class(base_pool, metrics),
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+    })
+    return options
+
+
+def psycopg2_connect_args():
+    # PgBouncer rejects the startup `options` parameter; set statement_timeout on the role instead
+    if settings.db_pgbouncer or not settings.db_statement_timeout_ms:
+        return {}
+    return {"options": f"-c statement_timeout={settings.db_statement_timeout_ms}"}
+
+
+def asyncpg_connect_args():
+    connect_args = {"ssl": "require"}
+    if settings.db_pgbouncer:
+        # Transaction pooling can hand each statement a different server connection
+        connect_args["statement_cache_size"] = 0
+    elif settings.db_statement_timeout_ms:
+        connect_args["server_settings"] = {"statement_timeout": str(settings.db_statement_timeout_ms)}
+    return connect_args
@@ -0,0 +1,171 @@
+from sqlalchemy import select, insert, update, delete, func, literal_column, exists, case, null
+from sqlalchemy.dialects.postgresql import array, insert as pg_insert
+from sqlalchemy.orm import Session
+from typing import List
+from . import models
+
+# Incremental maintenance of models.EventSummary. Every helper only stages its
+# statement on the caller's session, so the summary commits atomically with the
+# event/attend/invitation write that caused it.
+
+EMPTY_INT_ARRAY = literal_column("'{}'::integer[]")
+
+
+def create_summary(db: Session, event: models.Event, host_email: str):
+    db.add(models.EventSummary(
+        event_id=event.id,
+        host_email=host_email,
+        event_time=event.event_time,
+        public=event.public,
+        participant_count=0,
+        participant_ids=[],
+        invited_user_ids=[]
+    ))
+    db.flush()
+
+
+def sync_event(db: Session, event_id: int, event_time, public: bool):
+    db.execute(
+        update(models.EventSummary)
+        .where(models.EventSummary.event_id == event_id)
+        .values(event_time=event_time, public=public)
+    )
+
+
+def add_participant(db: Session, event_id: int, user_id: int):
+    db.execute(
+        update(models.EventSummary)
+        .where(models.EventSummary.event_id == event_id)
+        .values(
+            participant_count=models.EventSummary.participant_count + 1,
+            participant_ids=func.array_append(models.EventSummary.participant_ids, user_id)
+        )
+    )
+
+
+def add_participants(db: Session, event_id: int, user_ids: List[int]):
+    # Callers pass only users that were not attending before
+    if not user_ids:
+        return
+    db.execute(
+        update(models.EventSummary)
+        .where(models.EventSummary.event_id == event_id)
+        .values(
+            participant_count=models.EventSummary.participant_count + len(user_ids),
+            participant_ids=func.array_cat(models.EventSummary.participant_ids, array(list(user_ids)))
+        )
+    )
+
+
+def remove_participant(db: Session, event_id: int, user_id: int):
+    db.execute(
+        update(models.EventSummary)
+        .where(models.EventSummary.event_id == event_id)
+        .values(
+            participant_count=models.EventSummary.participant_count - 1,
+            participant_ids=func.array_remove(models.EventSummary.participant_ids, user_id)
+        )
+    )
+
+
+def audience():
+    # Who may see the event: NULL for public events, the invited user ids otherwise
+    return case((models.EventSummary.public, null()), else_=models.EventSummary.invited_user_ids)
+
+
+def join_statement(event_id: int, user_id: int):
+    # One statement: insert the attend row (a no-op when it exists) and bump the
+    # summary by however many rows were inserted. Returns (participant_count, changed, audience).
+    joined = (
+        pg_insert(models.Attend)
+        .values(event_id=event_id, user_id=user_id)
+        .on_conflict_do_nothing()
+        .returning(models.Attend.user_id)
+        .cte("joined")
+    )
+    changed = select(func.count()).select_from(joined).scalar_subquery()
+    return (
+        update(models.EventSummary)
+        .where(models.EventSummary.event_id == event_id)
+        .values(
+            participant_count=models.EventSummary.participant_count + changed,
+            participant_ids=func.array_cat(models.EventSummary.participant_ids, select(func.array_agg(joined.c.user_id)).scalar_subquery())
+        )
+        .returning(models.EventSummary.participant_count, changed, audience())
+    )
+
+
+def leave_statement(event_id: int, user_id: int):
+    # Counterpart of join_statement; leaving an event you don't attend changes nothing
+    left = (
+        delete(models.Attend)
+        .where(models.Attend.event_id == event_id, models.Attend.user_id == user_id)
+        .returning(models.Attend.user_id)
+        .cte("left_users")
+    )
+    changed = select(func.count()).select_from(left).scalar_subquery()
+    return (
+        update(models.EventSummary)
+        .where(models.EventSummary.event_id == event_id)
+        .values(
+            participant_count=models.EventSummary.participant_count - changed,
+            participant_ids=func.array_remove(models.EventSummary.participant_ids, select(left.c.user_id).scalar_subquery())
+        )
+        .returning(models.EventSummary.participant_count, changed, audience())
+    )
+
+
+def add_invitees(db: Session, event_id: int, user_ids: List[int]):
+    # Callers pass only users that were not invited before
+    if not user_ids:
+        return
+    db.execute(
+        update(models.EventSummary)
+        .where(models.EventSummary.event_id == event_id)
+        .values(invited_user_ids=func.array_cat(models.EventSummary.invited_user_ids, array(list(user_ids))))
+    )
+
+
+def backfill_missing(db: Session):
+    # Builds summaries for events that predate the read model (or were written
+    # around it). Runs once at startup; a no-op when every event has a summary.
+    participants = (
+        select(
+            models.Attend.event_id,
+            func.count().label("participant_count"),
+            func.array_agg(models.Attend.user_id).label("participant_ids")
+        )
+        .group_by(models.Attend.event_id)
+        .subquery()
+    )
+    invitations = (
+        select(
+            models.Invitation.event_id,
+            func.array_agg(func.distinct(models.Invitation.user_id)).label("invited_user_ids")
+        )
+        .group_by(models.Invitation.event_id)
+        .subquery()
+    )
+    rows = (
+        select(
+            models.Event.id,
+            models.User.email,
+            models.Event.event_time,
+            models.Event.public,
+            func.coalesce(participants.c.participant_count, 0),
+            func.coalesce(participants.c.participant_ids, EMPTY_INT_ARRAY),
+            func.coalesce(invitations.c.invited_user_ids, EMPTY_INT_ARRAY)
+        )
+        .join(models.User, models.User.id == models.Event.host_id)
+        .outerjoin(participants, participants.c.event_id == models.Event.id)
+        .outerjoin(invitations, invitations.c.event_id == models.Event.id)
+        .where(~exists().where(models.EventSummary.event_id == models.Event.id))
+    )
+    result = db.execute(
+        insert(models.EventSummary).from_select(
+            ["event_id", "host_email", "event_time", "public", "participant_count", "participant_ids", "invited_user_ids"],
+            rows
+        )
+    )
+    db.commit()
+    return result.rowcount
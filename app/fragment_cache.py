@@ -0,0 +1,85 @@
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+import threading
+import time
+from .cache import TTLCache
+from .config import settings
+
+# Rendered HTML fragments (and the small values next to them, like the feed's badge
+# counts), so repeat loads skip both the queries and the Jinja render. Keys start
+# with the fragment kind and carry the content_versions stamp they were built from
+# (see app/versions.py): a write bumps the stamp and the old entries simply stop
+# being looked up, in every worker, until LRU/TTL drops them.
+
+
+class FragmentCache:
+    def __init__(self, maxsize: int = settings.fragment_cache_size, ttl: int = settings.fragment_cache_ttl_seconds):
+        self.cache = TTLCache(maxsize, ttl)
+        self.lock = threading.Lock()
+        self.kinds = defaultdict(lambda: {"hits": 0, "misses": 0, "render_seconds": 0.0, "saved_seconds": 0.0})
+
+    async def get_or_render(self, key: Tuple[Hashable, ...], render: Callable[[], Awaitable[Any]]) -> Any:
+        kind = key[0]
+        entry = self.cache.get(key)
+        if entry is not None:
+            value, cost = entry
+            with self.lock:
+                self.kinds[kind]["hits"] += 1
+                self.kinds[kind]["saved_seconds"] += cost
+            return value
+        started = time.perf_counter()
+        value = await render()
+        cost = time.perf_counter() - started
+        self.cache.set(key, (value, cost))
+        with self.lock:
+            self.kinds[kind]["misses"] += 1
+            self.kinds[kind]["render_seconds"] += cost
+        return value
+
+    async def get_or_render_many(self, keys: List[Tuple[Hashable, ...]],
+                                 render: Callable[[List[Tuple[Hashable, ...]]], Awaitable[Dict[Tuple[Hashable, ...], Any]]]) -> Dict[Tuple[Hashable, ...], Any]:
+        # For pages assembled from many entries of one kind: render() gets every missing
+        # key at once, so the misses share one query. Keys it leaves out are not cached.
+        kind = keys[0][0] if keys else None
+        found = {}
+        saved = 0.0
+        for key in keys:
+            entry = self.cache.get(key)
+            if entry is not None:
+                found[key], cost = entry
+                saved += cost
+        missing = [key for key in keys if key not in found]
+        cost = 0.0
+        if missing:
+            started = time.perf_counter()
+            rendered = await render(missing)
+            cost = time.perf_counter() - started
+            for key, value in rendered.items():
+                self.cache.set(key, (value, cost / len(missing)))
+            found.update(rendered)
+        if kind is not None:
+            with self.lock:
+                self.kinds[kind]["hits"] += len(keys) - len(missing)
+                self.kinds[kind]["misses"] += len(missing)
+                self.kinds[kind]["saved_seconds"] += saved
+                self.kinds[kind]["render_seconds"] += cost
+        return found
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        stats = self.cache.stats()
+        with self.lock:
+            kinds = {kind: dict(counters) for kind, counters in self.kinds.items()}
+        for counters in kinds.values():
+            lookups = counters["hits"] + counters["misses"]
+            counters["hit_ratio"] = counters["hits"] / lookups if lookups else 0.0
+            counters["render_ms"] = counters.pop("render_seconds") * 1000
+            counters["render_ms_saved"] = counters.pop("saved_seconds") * 1000
+        stats["render_ms_saved"] = sum(counters["render_ms_saved"] for counters in kinds.values())
+        stats["kinds"] = kinds
+        return stats
+
+
+fragment_cache = FragmentCache()
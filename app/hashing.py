@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import threading
+import time
+from . import utils
+from .config import settings
+
+# bcrypt runs in its own small pool instead of the threadpool every sync route shares.
+# Login and signup are async routes that await the pool, so a waiting request holds no
+# thread at all, and the number of waiting requests is capped so a burst is rejected
+# (429) instead of queueing up behind itself.
+
+
+class HashingOverloaded(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = settings.password_hash_workers, max_pending: int = settings.password_hash_max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.peak_pending = 0
+        self.rejected = 0
+        self.completed = 0
+        self.rehashed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.total_wait_seconds = 0.0
+
+    async def _run(self, func, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingOverloaded()
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+        submitted = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(self._get_executor().submit(self._timed, submitted, func, *args))
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+            return self.executor
+
+    def _timed(self, submitted: float, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.completed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+                self.total_wait_seconds += started - submitted
+
+    async def hash(self, password: str) -> str:
+        return await self._run(utils.hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        # The new hash is set when the stored one uses an outdated scheme or cost
+        valid, new_hash = await self._run(utils.verify_and_update, plain_password, hashed_password)
+        if new_hash is not None:
+            with self.lock:
+                self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "bcrypt_rounds": settings.bcrypt_rounds,
+                "pending": self.pending,
+                "peak_pending": self.peak_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "avg_hash_ms": self.total_seconds / self.completed * 1000 if self.completed else 0.0,
+                "max_hash_ms": self.max_seconds * 1000,
+                "avg_wait_ms": self.total_wait_seconds / self.completed * 1000 if self.completed else 0.0,
+            }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,115 @@
+from sqlalchemy import select, exists, any_, bindparam, String, text
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Tuple
+from . import models, user_search, event_summary
+
+# Invitations and attendance. Bulk writes resolve every email with one `email = ANY(...)`
+# query and insert with ON CONFLICT DO NOTHING; RETURNING tells which rows are new for
+# the event summary. Invitable users are one anti-join against invitations, paged by email.
+
+
+def ensure_invitation_schema(engine: Engine):
+    # Older databases may hold duplicate invitations; keep the first before adding the unique index
+    with engine.begin() as conn:
+        conn.execute(text(
+            "DELETE FROM invitations a USING invitations b "
+            "WHERE a.event_id = b.event_id AND a.user_id = b.user_id AND a.id > b.id"
+        ))
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_invitations_event_id_user_id ON invitations (event_id, user_id)"
+        ))
+
+
+def resolve_emails(db: Session, emails: List[str]) -> Tuple[Dict[str, int], List[str]]:
+    # Returns {email: user id} for known users and the emails that matched nobody, in input order
+    emails = list(dict.fromkeys(email.strip() for email in emails if email and email.strip()))
+    if not emails:
+        return {}, []
+    rows = db.execute(
+        select(models.User.email, models.User.id)
+        .where(models.User.email == any_(bindparam("emails", emails, type_=ARRAY(String))))
+    ).all()
+    user_ids = {email: user_id for email, user_id in rows}
+    return user_ids, [email for email in emails if email not in user_ids]
+
+
+def add_invitations(db: Session, event_id: int, user_ids: List[int]) -> List[int]:
+    # Stages the invitations and returns the ids of users that were not invited before
+    if not user_ids:
+        return []
+    invited = db.execute(
+        insert(models.Invitation)
+        .values([{"event_id": event_id, "user_id": user_id} for user_id in dict.fromkeys(user_ids)])
+        .on_conflict_do_nothing(index_elements=["event_id", "user_id"])
+        .returning(models.Invitation.user_id)
+    ).scalars().all()
+    event_summary.add_invitees(db, event_id, invited)
+    return invited
+
+
+def add_attendees(db: Session, event_id: int, user_ids: List[int]) -> List[int]:
+    if not user_ids:
+        return []
+    added = db.execute(
+        insert(models.Attend)
+        .values([{"event_id": event_id, "user_id": user_id} for user_id in dict.fromkeys(user_ids)])
+        .on_conflict_do_nothing(index_elements=["user_id", "event_id"])
+        .returning(models.Attend.user_id)
+    ).scalars().all()
+    event_summary.add_participants(db, event_id, added)
+    return added
+
+
+def bulk_result(user_ids: Dict[str, int], unknown: List[str], added_ids: List[int]):
+    added = set(added_ids)
+    return {
+        "added": [email for email, user_id in user_ids.items() if user_id in added],
+        "already_present": [email for email, user_id in user_ids.items() if user_id not in added],
+        "unknown": unknown,
+    }
+
+
+def invite_emails(db: Session, event_id: int, emails: List[str]) -> Tuple[dict, List[int]]:
+    # Stages the invitations on the caller's session; the caller commits. Also returns
+    # the ids of the newly invited users, who are sent the event as new on their feeds.
+    user_ids, unknown = resolve_emails(db, emails)
+    invited = add_invitations(db, event_id, list(user_ids.values()))
+    return bulk_result(user_ids, unknown, invited), invited
+
+
+def import_attendees(db: Session, event_id: int, emails: List[str], public: bool):
+    # Attendees of a private event are invited as well, so the event shows up for them
+    user_ids, unknown = resolve_emails(db, emails)
+    if not public:
+        add_invitations(db, event_id, list(user_ids.values()))
+    added = add_attendees(db, event_id, list(user_ids.values()))
+    return bulk_result(user_ids, unknown, added)
+
+
+def not_invited_to(event_id: int):
+    return ~exists().where(
+        models.Invitation.event_id == event_id,
+        models.Invitation.user_id == models.User.id
+    )
+
+
+def invitable_users_query(event_id: int, host_id: int, search_query: Optional[str] = None):
+    query = select(models.User.id, models.User.email).where(
+        models.User.id != host_id,
+        not_invited_to(event_id)
+    )
+    if search_query:
+        query = query.where(user_search.email_filter(search_query))
+    return query
+
+
+def invitable_users(db: Session, event_id: int, host_id: int, search_query: Optional[str] = None, after: Optional[str] = None, limit: int = 50):
+    # Returns one page of users ordered by email and the email to continue after, if any
+    query = invitable_users_query(event_id, host_id, search_query)
+    if after:
+        query = query.where(models.User.email > after)
+    users = db.execute(query.order_by(models.User.email).limit(limit + 1)).all()
+    next_after = users[limit - 1].email if len(users) > limit else None
+    return users[:limit], next_after
@@ -0,0 +1,125 @@
+from fastapi import Request
+from typing import Dict, List, Optional
+import asyncio
+import json
+import logging
+from .config import settings
+from .pubsub import PubSubBackend, get_pubsub_backend
+
+# Live feed updates pushed to open feeds over Server-Sent Events (GET /events/stream):
+#   participants - {"event_id", "count", "delta"} after a join, leave or attendee import
+#   new_event    - {"event_id", "public"} after an event is created
+# Messages about a private event carry "user_ids", its invitees, and only reach their
+# streams. Messages travel through the same pub/sub backends as chat, so with the
+# postgres backend a join handled by one worker reaches feeds open on every other worker.
+
+UPDATES_CHANNEL = 0
+
+# Keeps private-event messages well inside the NOTIFY payload limit
+MAX_USER_IDS_PER_MESSAGE = 500
+
+
+def for_audience(message: dict, user_ids: Optional[List[int]]) -> List[dict]:
+    # user_ids None means public; a private event with no invitees reaches nobody
+    if user_ids is None:
+        return [message]
+    return [
+        {**message, "user_ids": user_ids[i:i + MAX_USER_IDS_PER_MESSAGE]}
+        for i in range(0, len(user_ids), MAX_USER_IDS_PER_MESSAGE)
+    ]
+
+
+def participants_messages(event_id: int, count: int, delta: int, user_ids: Optional[List[int]]) -> List[dict]:
+    return for_audience({"type": "participants", "event_id": event_id, "count": count, "delta": delta}, user_ids)
+
+
+def new_event_messages(event_id: int, public: bool, user_ids: List[int]) -> List[dict]:
+    return for_audience({"type": "new_event", "event_id": event_id, "public": public}, None if public else user_ids)
+
+
+class FeedUpdates:
+    def __init__(self, backend: PubSubBackend, max_queue_size: int = settings.live_updates_queue_size):
+        self.backend = backend
+        self.max_queue_size = max_queue_size
+        self.loop = None
+        # outbound queue -> id of the user whose feed it serves
+        self.subscribers: Dict[asyncio.Queue, int] = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await self.backend.subscribe(UPDATES_CHANNEL, self.deliver)
+
+    async def stop(self):
+        await self.backend.unsubscribe(UPDATES_CHANNEL)
+        await self.backend.close()
+        self.loop = None
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.subscribers[queue] = user_id
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.pop(queue, None)
+
+    async def publish(self, *messages: dict):
+        for message in messages:
+            self.published += 1
+            await self.backend.publish(UPDATES_CHANNEL, json.dumps(message))
+
+    def notify(self, *messages: dict):
+        # For the sync routes running in the threadpool; call after the commit
+        if self.loop is None:
+            return
+        for message in messages:
+            asyncio.run_coroutine_threadsafe(self.publish(message), self.loop)
+
+    def deliver(self, _, message_json: str):
+        try:
+            message = json.loads(message_json)
+        except ValueError:
+            logging.error(f"Ignoring malformed feed update: {message_json}")
+            return
+        user_ids = set(message["user_ids"]) if "user_ids" in message else None
+        for queue, user_id in list(self.subscribers.items()):
+            if user_ids is not None and user_id not in user_ids:
+                continue
+            if queue.full():
+                # Counts are absolute, so a slow feed only loses intermediate values
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(message)
+            self.delivered += 1
+
+    async def stream(self, request: Request, user_id: int, keepalive_seconds: Optional[float] = None):
+        keepalive_seconds = keepalive_seconds or settings.live_updates_keepalive_seconds
+        queue = self.subscribe(user_id)
+        try:
+            # Browsers reconnect on their own; tell them not to hammer the server
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                message = {key: value for key, value in message.items() if key != "user_ids"}
+                yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+    def stats(self):
+        return {
+            "backend": self.backend.name,
+            "subscribers": len(self.subscribers),
+            "queue_depths": [queue.qsize() for queue in self.subscribers],
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+feed_updates = FeedUpdates(get_pubsub_backend(settings.live_updates_backend, channel_prefix="feed_updates_"))
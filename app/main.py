@@ -1,12 +1,18 @@
 from fastapi import FastAPI, Response, status, HTTPException, Depends, Request, UploadFile, File, Form, WebSocket, WebSocketDisconnect
-from . import models, schemas, utils, oauth2
+from . import models, schemas, utils, oauth2, event_summary, search, tagging, user_search, invitations, uploads, compression
 from sqlalchemy.orm import Session
-from .database import engine, get_db
+from .database import engine, get_db, SessionLocal, async_engine, pool_metrics, async_pool_metrics
 from .routers import event, user, auth, attend
+from .chat import manager, message_writer, ensure_chat_schema
+from .user_cache import user_cache
+from .hashing import HashingOverloaded, password_hasher
+from .media import media_store, ImmutableStaticFiles
+from .compression import CompressionMiddleware
+from .fragment_cache import fragment_cache
+from .live import feed_updates
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import shutil
 import os
 from .config import settings
 from datetime import datetime, timedelta
@@ -20,6 +26,11 @@ from fastapi.middleware.cors import CORSMiddleware
 
 
 models.Base.metadata.create_all(bind = engine)
+search.ensure_search_schema(engine)
+tagging.ensure_tagging_schema(engine)
+user_search.ensure_user_search_schema(engine)
+invitations.ensure_invitation_schema(engine)
+ensure_chat_schema(engine)
 
 app = FastAPI()
 
@@ -33,10 +44,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
 
+# Content-addressed pictures get immutable caching; mounted first so it wins over /static
+os.makedirs(settings.media_root, exist_ok=True)
+app.mount("/static/media", ImmutableStaticFiles(directory=settings.media_root), name="media")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 templates = Jinja2Templates(directory = "templates")
+templates.env.globals["thumbnail"] = uploads.thumbnail
 
 app.include_router(event.router)
 app.include_router(user.router)
@@ -46,68 +62,150 @@ app.include_router(attend.router)
 logging.basicConfig(level=logging.INFO)
 
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logging.info(f"WebSocket connected: {websocket.client}")
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            logging.info(f"WebSocket disconnected: {websocket.client}")
-
-    async def broadcast(self, message: dict):
-        message_json = json.dumps(message)
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message_json)
-                logging.info(f"Broadcasting message: {message_json} to {connection.client}")
-            except RuntimeError as e:
-                logging.error(f"Failed to send message to {connection.client}: {e}")
-                self.disconnect(connection)
-                logging.info(f"Removed closed connection: {connection.client}")
-
-manager = ConnectionManager()
-
 @app.websocket("/ws/{event_id}")
-async def websocket_endpoint(websocket: WebSocket, event_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user_ws)):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, event_id: int, current_user: models.User = Depends(oauth2.get_current_user_ws)):
+    await manager.connect(websocket, event_id)
     try:
         while True:
             data = await websocket.receive_text()
             logging.info(f"Received message: {data} from user: {current_user.email}")
             
             parsed_data = json.loads(data)
-            message = models.Message(content=parsed_data['content'], user_id=current_user.id, event_id=event_id)
-            
-            logging.info(f"Creating message: {message}")
-            
-            db.add(message)
-            db.commit()
-            
-            logging.info(f"Message committed: {message}")
-            
-            db.refresh(message)
-            
-            logging.info(f"Message refreshed: {message}")
-            
-            await manager.broadcast({
+            timestamp = datetime.utcnow()
+            message_id = await message_writer.next_id()
+
+            # Broadcast right away; the message is persisted by the background writer
+            await manager.broadcast(event_id, {
+                "id": message_id,
                 "content": parsed_data['content'],
                 "email": current_user.email,
-                "user_id": current_user.id
+                "user_id": current_user.id,
+                "timestamp": timestamp.isoformat()
             })
+            await message_writer.enqueue(message_id, event_id, current_user.id, parsed_data['content'], timestamp)
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        manager.disconnect(websocket, event_id)
     except Exception as e:
         logging.error(f"Unexpected error: {e}")
+        manager.disconnect(websocket, event_id)
         if websocket.client_state == "CONNECTED":
             await websocket.send_text(json.dumps({"error": str(e)}))
         await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
 
+@app.on_event("startup")
+async def startup_chat():
+    message_writer.start()
+
+@app.on_event("startup")
+async def startup_tagging():
+    tagging.tagging_worker.start()
+
+@app.on_event("shutdown")
+async def shutdown_tagging():
+    await tagging.tagging_worker.stop()
+
+@app.exception_handler(HashingOverloaded)
+def hashing_overloaded(request: Request, exc: HashingOverloaded):
+    content = '<div class="mb-7 text-center text-red-500 text-xl font-bold">Too many sign-ins and sign-ups right now, please try again in a moment</div>'
+    return HTMLResponse(content=content, status_code=status.HTTP_429_TOO_MANY_REQUESTS, headers={"Retry-After": "1"})
+
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+@app.exception_handler(uploads.UploadTooLarge)
+def upload_too_large(request: Request, exc: uploads.UploadTooLarge):
+    content = f'<div class="mb-7 text-center text-red-500 text-xl font-bold">Pictures can be at most {exc.max_bytes // (1024 * 1024)} MB</div>'
+    return HTMLResponse(content=content, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+@app.on_event("shutdown")
+def shutdown_thumbnailer():
+    uploads.thumbnailer.shutdown()
+
+@app.on_event("startup")
+async def startup_user_cache():
+    await user_cache.start()
+
+@app.on_event("startup")
+async def startup_feed_updates():
+    await feed_updates.start()
+
+@app.on_event("shutdown")
+async def shutdown_feed_updates():
+    await feed_updates.stop()
+
+@app.on_event("shutdown")
+async def shutdown_user_cache():
+    await user_cache.stop()
+
+@app.on_event("startup")
+def backfill_event_summaries():
+    db = SessionLocal()
+    try:
+        created = event_summary.backfill_missing(db)
+        if created:
+            logging.info(f"Backfilled {created} event summaries")
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+async def shutdown_chat():
+    await message_writer.stop()
+    await manager.backend.close()
+
+@app.get("/ws/stats")
+def websocket_stats():
+    stats = manager.stats()
+    stats["message_writer"] = message_writer.stats()
+    stats["feed_updates"] = feed_updates.stats()
+    return stats
+
+
+@app.get("/db/stats")
+def database_stats():
+    return {
+        "sync": pool_metrics.stats(engine.pool),
+        "async": async_pool_metrics.stats(async_engine.sync_engine.pool),
+    }
+
+
+@app.get("/auth/stats")
+def auth_stats():
+    return {
+        "user_cache": user_cache.stats(),
+        "token_cache": oauth2.token_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+    }
+
+
+@app.get("/fragments/stats")
+def fragment_stats():
+    return fragment_cache.stats()
+
+
+@app.get("/compression/stats")
+def compression_stats():
+    return {
+        "encodings": ["br", "gzip"] if compression.brotli is not None else ["gzip"],
+        "minimum_size": settings.compression_minimum_size,
+        **compression.stats,
+    }
+
+
+@app.get("/media/stats")
+def media_stats():
+    return {
+        "store": media_store.stats(),
+        "thumbnails": uploads.thumbnailer.stats(),
+    }
+
+
+@app.get("/tagging/stats")
+async def tagging_stats():
+    stats = tagging.tagging_worker.stats()
+    stats["model"] = await tagging.tagging_worker.model_stats()
+    return stats
+
 
 @app.get("/", response_class = HTMLResponse)
 def home(request : Request):
@@ -121,8 +219,8 @@ def signup(request : Request):
 
 @app.get("/create_event", response_class=HTMLResponse)
 def get_create_event_form(request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
-    users = db.query(models.User).filter(models.User.email != current_user.email).all()
-    return templates.TemplateResponse("create_event.html", {"request": request, "users": users, "current_user": current_user})
+    # Invitees are picked through the /users/search typeahead
+    return templates.TemplateResponse("create_event.html", {"request": request, "current_user": current_user})
 
 @app.get("/{user_id}/general_profile", response_class=HTMLResponse)
 def get_general_profile(user_id: int, request: Request, db: Session = Depends(get_db)):
@@ -177,22 +275,12 @@ def get_profile(
         for event in joined_events_query
     ]
 
-    # Get all users excluding the current user
-    all_users = db.query(models.User).filter(models.User.id != current_user.id).all()
-
-    # Prepare a dictionary to hold non-invited users for each event
-    non_invited_users = {}
-    for event in events:
-        invited_user_ids = db.query(models.Invitation.user_id).filter(models.Invitation.event_id == event.id).all()
-        invited_user_ids = [user_id for (user_id,) in invited_user_ids]
-        non_invited_users[event.id] = [user for user in all_users if user.id not in invited_user_ids]
-
+    # Invitable users are loaded per event by /events/{id}/invitable
     return templates.TemplateResponse("profile.html", {
         "request": request,
         "user": user,
         "events": events,
-        "joined_events": joined_events,
-        "non_invited_users": non_invited_users
+        "joined_events": joined_events
     })
 
 @app.post("/{user_id}/upload_profile_picture", response_class=HTMLResponse)
@@ -209,23 +297,25 @@ def upload_profile_picture(
     if not file:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No file uploaded")
 
-    # Save the file to a directory
-    file_location = f"static/profile_pictures/{user_id}_{file.filename}"
-    with open(file_location, "wb+") as file_object:
-        shutil.copyfileobj(file.file, file_object)
-    
+    # Stored by content, so the URL changes with the picture and can be cached forever
+    staged_picture = media_store.stage(file, os.path.splitext(file.filename)[1])
+
     # Update the user's profile picture path in the database
     user = db.query(models.User).filter(models.User.id == user_id).first()
-
-    # Delete the old profile picture if it exists
-    if user.profile_picture:
-        old_file_path = user.profile_picture
-        if os.path.exists(old_file_path):
-            os.remove(old_file_path)
-
-    user.profile_picture = file_location
-    db.commit()
-    db.refresh(user)
+    old_file_path = user.profile_picture
+    try:
+        user.profile_picture = staged_picture.path
+        db.commit()
+    except Exception:
+        db.rollback()
+        media_store.discard(staged_picture)
+        raise
+    user_cache.invalidate(user_id)
+
+    if media_store.publish(staged_picture):
+        uploads.thumbnailer.submit(staged_picture.path, ("avatar",))
+    if old_file_path != staged_picture.path:
+        media_store.release(old_file_path)
 
     return RedirectResponse(url=f"/{user_id}/profile", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -248,6 +338,7 @@ def update_profile(
     user.bio = bio
     user.school = school
     db.commit()
+    user_cache.invalidate(user_id)
     db.refresh(user)
 
     return templates.TemplateResponse("profile.html", {"request": request, "user": user})
@@ -0,0 +1,221 @@
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from sqlalchemy import select, union
+from sqlalchemy.orm import Session
+from typing import Iterable, Optional, Set
+import argparse
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from . import models, uploads
+from .config import settings
+from .database import SessionLocal
+
+# Content-addressed picture storage. A picture is stored once under the sha256 of
+# its bytes, so identical uploads share a file and a stored URL never changes
+# content; it can be cached forever. Uploads are staged before the transaction that
+# references them and published after its commit (discarded if it rolls back), so a
+# blob only appears once a row can point at it. Blobs no row references any more are
+# removed by collect_garbage (python -m app.media --gc) once they are older than
+# MEDIA_GC_GRACE_SECONDS.
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+SAFE_EXTENSION = re.compile(r"^\.[A-Za-z0-9]{1,5}$")
+
+
+class StagedMedia:
+    def __init__(self, path: str, staged_path: Optional[str]):
+        # path is where the blob lives once published; staged_path is None when the
+        # store already holds the same content
+        self.path = path
+        self.staged_path = staged_path
+
+
+class MediaStore:
+    def stage(self, upload: UploadFile, ext: str) -> StagedMedia:
+        raise NotImplementedError
+
+    def publish(self, staged: StagedMedia) -> bool:
+        # Call after the commit; returns whether a new blob was written (False when deduplicated)
+        raise NotImplementedError
+
+    def discard(self, staged: Optional[StagedMedia]):
+        raise NotImplementedError
+
+    def is_managed(self, path: Optional[str]) -> bool:
+        raise NotImplementedError
+
+    def collect_garbage(self, referenced: Set[str], grace_seconds: float) -> dict:
+        raise NotImplementedError
+
+    def release(self, path: Optional[str]):
+        # Called when a row stops pointing at path. Blobs may be shared, so they are
+        # left to the garbage collector; files from before the store are removed directly.
+        if path and not self.is_managed(path):
+            uploads.remove_upload(path)
+
+    def stats(self) -> dict:
+        return {}
+
+
+class LocalMediaStore(MediaStore):
+    def __init__(self, root: str = settings.media_root):
+        self.root = root.rstrip("/")
+        self.lock = threading.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_stored = 0
+        self.bytes_saved = 0
+
+    def path_for(self, digest: str, ext: str) -> str:
+        # The extension only helps StaticFiles pick a content type
+        ext = ext.lower() if SAFE_EXTENSION.match(ext) else ""
+        return f"{self.root}/{digest[:2]}/{digest}{ext}"
+
+    def stage(self, upload: UploadFile, ext: str) -> StagedMedia:
+        os.makedirs(f"{self.root}/.tmp", exist_ok=True)
+        staged_path = f"{self.root}/.tmp/{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(staged_path, "wb") as buffer:
+                for chunk in uploads.read_chunks(upload):
+                    digest.update(chunk)
+                    buffer.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            uploads.discard_upload(staged_path)
+            raise
+
+        path = self.path_for(digest.hexdigest(), ext)
+        if os.path.exists(path):
+            uploads.discard_upload(staged_path)
+            # A fresh mtime keeps a blob that is about to be referenced again out of the next GC
+            os.utime(path)
+            with self.lock:
+                self.deduplicated += 1
+                self.bytes_saved += size
+            return StagedMedia(path, None)
+        return StagedMedia(path, staged_path)
+
+    def publish(self, staged: StagedMedia) -> bool:
+        if staged.staged_path is None:
+            return False
+        os.makedirs(os.path.dirname(staged.path), exist_ok=True)
+        size = os.path.getsize(staged.staged_path)
+        uploads.finalize_upload(staged.staged_path, staged.path)
+        with self.lock:
+            self.stored += 1
+            self.bytes_stored += size
+        return True
+
+    def discard(self, staged: Optional[StagedMedia]):
+        if staged is not None and staged.staged_path is not None:
+            uploads.discard_upload(staged.staged_path)
+
+    def is_managed(self, path: Optional[str]) -> bool:
+        return bool(path) and path.startswith(self.root + "/")
+
+    def files(self) -> Iterable[str]:
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                yield os.path.join(directory, filename)
+
+    def collect_garbage(self, referenced: Set[str], grace_seconds: float) -> dict:
+        # Thumbnails share their blob's digest prefix, so they go with it
+        referenced_digests = {os.path.basename(path)[:64] for path in referenced if self.is_managed(path)}
+        cutoff = time.time() - grace_seconds
+        removed = 0
+        bytes_freed = 0
+        for path in self.files():
+            name = os.path.basename(path)
+            if not name.endswith(".part") and name[:64] in referenced_digests:
+                continue
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime > cutoff:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            bytes_freed += stat.st_size
+        return {"files_removed": removed, "bytes_freed": bytes_freed}
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "backend": "local",
+                "root": self.root,
+                "stored": self.stored,
+                "deduplicated": self.deduplicated,
+                "bytes_stored": self.bytes_stored,
+                "bytes_saved": self.bytes_saved,
+            }
+
+
+BACKENDS = {
+    "local": LocalMediaStore,
+}
+
+
+def get_media_store(name: str = settings.media_backend) -> MediaStore:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown media backend: {name}")
+    return BACKENDS[name]()
+
+
+class ImmutableStaticFiles(StaticFiles):
+    # Stored files never change, so browsers and proxies may keep them for a year.
+    # The file name (the content digest) is the ETag.
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            stat_result=stat_result,
+            headers={
+                "cache-control": IMMUTABLE_CACHE_CONTROL,
+                "etag": f'"{os.path.splitext(os.path.basename(full_path))[0]}"',
+            },
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def referenced_paths(db: Session) -> Set[str]:
+    query = union(
+        select(models.Event.picture).where(models.Event.picture.isnot(None)),
+        select(models.User.profile_picture).where(models.User.profile_picture.isnot(None)),
+    )
+    return set(db.execute(query).scalars())
+
+
+def collect_garbage(db: Session, grace_seconds: Optional[float] = None) -> dict:
+    grace_seconds = settings.media_gc_grace_seconds if grace_seconds is None else grace_seconds
+    return media_store.collect_garbage(referenced_paths(db), grace_seconds)
+
+
+media_store = get_media_store()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove stored pictures that no event or user references")
+    parser.add_argument("--gc", action="store_true", help="delete unreferenced blobs older than MEDIA_GC_GRACE_SECONDS")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.gc:
+        db = SessionLocal()
+        try:
+            result = collect_garbage(db)
+        finally:
+            db.close()
+        print(f"Removed {result['files_removed']} files, {result['bytes_freed']} bytes")
+    else:
+        parser.print_help()
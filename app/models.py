@@ -1,9 +1,16 @@
 from .database import Base
-from sqlalchemy import Column, Integer, String, DateTime, Date, ForeignKey, ARRAY, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Date, ForeignKey, ARRAY, Boolean, Index, Computed
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql.expression import text
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 
+# Full-text document for event search, kept up to date by Postgres itself
+EVENT_SEARCH_VECTOR_SQL = (
+    "to_tsvector('english', coalesce(title, '') || ' ' || "
+    "coalesce(description, '') || ' ' || coalesce(location, ''))"
+)
+
 class Event(Base):
     __tablename__ = 'events'
 
@@ -17,8 +24,17 @@ class Event(Base):
     host_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     tags = Column(ARRAY(String), nullable=True)
     public = Column(Boolean, nullable=False, default=True)
+    tag_status = Column(String, nullable=False, server_default=text("'done'"))  # pending / done / failed, see app/tagging.py
+    tag_claimed_at = Column(DateTime, nullable=True)  # when a tagging worker took the pending event
     messages = relationship("Message", back_populates="event", cascade="all, delete-orphan")
     invitations = relationship("Invitation", back_populates="event", cascade="all, delete-orphan")
+    # Deferred so regular event queries don't ship the tsvector around
+    search_vector = deferred(Column(postgresql.TSVECTOR, Computed(EVENT_SEARCH_VECTOR_SQL, persisted=True)))
+
+    __table_args__ = (
+        Index("ix_events_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_events_tags", "tags", postgresql_using="gin"),
+    )
 
 class User(Base):
     __tablename__ = 'users'
@@ -33,6 +49,11 @@ class User(Base):
     messages = relationship("Message", back_populates="user")
     invitations = relationship("Invitation", back_populates="user")
 
+    # Email prefix search for the invitee typeahead, see app/user_search.py
+    __table_args__ = (
+        Index("ix_users_email_lower_prefix", text("lower(email) text_pattern_ops")),
+    )
+
 class Attend(Base):
     __tablename__ = "attends"
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
@@ -50,6 +71,11 @@ class Message(Base):
     user = relationship("User", back_populates="messages")
     event = relationship("Event", back_populates="messages")
 
+    # Backs keyset pagination of a chat's history on (timestamp, id)
+    __table_args__ = (
+        Index("ix_messages_event_id_timestamp_id", "event_id", "timestamp", "id"),
+    )
+
 class Invitation(Base):
     __tablename__ = 'invitations'
     
@@ -60,4 +86,45 @@ class Invitation(Base):
     accepted = Column(Boolean, nullable=False, default=False)
     
     event = relationship("Event", back_populates="invitations")
-    user = relationship("User", back_populates="invitations")
\ No newline at end of file
+    user = relationship("User", back_populates="invitations")
+
+    # One invitation per user and event; bulk invites rely on it for ON CONFLICT DO NOTHING
+    __table_args__ = (
+        Index("uq_invitations_event_id_user_id", "event_id", "user_id", unique=True),
+    )
+
+class EventSummary(Base):
+    # Read model for the events feed, kept in step with events, attends and invitations
+    # by app/event_summary.py so the feed never has to aggregate attendance per request
+    __tablename__ = 'event_summary'
+
+    event_id = Column(Integer, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True)
+    host_email = Column(String, nullable=False)
+    event_time = Column(DateTime, nullable=False)
+    public = Column(Boolean, nullable=False)
+    participant_count = Column(Integer, nullable=False, server_default=text('0'))
+    participant_ids = Column(postgresql.ARRAY(Integer), nullable=False, server_default=text("'{}'"))
+    invited_user_ids = Column(postgresql.ARRAY(Integer), nullable=False, server_default=text("'{}'"))
+
+    __table_args__ = (
+        Index("ix_event_summary_public_event_time_event_id", "public", "event_time", "event_id"),
+        Index("ix_event_summary_public_participant_count", "public", "participant_count"),
+        Index("ix_event_summary_invited_user_ids", "invited_user_ids", postgresql_using="gin"),
+    )
+
+
+class TagCacheEntry(Base):
+    # Persistent memo of NER tags per description content hash, shared by all workers
+    __tablename__ = 'tag_cache'
+
+    description_hash = Column(String(64), primary_key=True)
+    tags = Column(ARRAY(String), nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=text('now()'))
+
+
+class ContentVersion(Base):
+    # Change counters behind the feed/event ETags, bumped by app/versions.py
+    __tablename__ = 'content_versions'
+
+    key = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, server_default=text('1'))
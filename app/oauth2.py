@@ -1,10 +1,12 @@
-from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
 from . import schemas, database, models
 from fastapi import Depends, status, HTTPException, Request, WebSocket
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from .config import settings
+from .user_cache import user_cache
+from .tokens import TokenError, token_cache
 ouath2_scheme = OAuth2PasswordBearer(tokenUrl = "login")
 import logging
 # SECRET_KEY
@@ -19,21 +21,39 @@ ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 def create_access_token(data: dict):
     to_encode = data.copy()
     to_encode.update({"user_id": str(data.get("user_id"))})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = token_cache.backend.encode(to_encode)
     return encoded_jwt
 
 def verify_access_token(token: str, credentials_exception):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Signature checks only run the first time a token is seen
+        payload = token_cache.decode(token)
         id: str = payload.get("user_id")
         if id is None:
             raise credentials_exception
         token_data = schemas.TokenData(id=id)
-    except JWTError:
+    except TokenError:
         raise credentials_exception
     return token_data
 
-def get_current_user(request: Request, db: Session = Depends(database.get_db)):
+def load_user(db: Session, user_id: int):
+    # The token already carries the id, so the users row only has to be read on a cache miss
+    user = user_cache.get(user_id)
+    if user is None:
+        user = db.query(models.User).filter(models.User.id == user_id).first()
+        if user is not None:
+            user_cache.set(user)
+    return user
+
+async def load_user_async(db: AsyncSession, user_id: int):
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await db.get(models.User, user_id)
+        if user is not None:
+            user_cache.set(user)
+    return user
+
+def get_token_data(request: Request):
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(
@@ -46,12 +66,21 @@ def get_current_user(request: Request, db: Session = Depends(database.get_db)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    token = verify_access_token(token, credentials_exception)
-    user = db.query(models.User).filter(models.User.id == token.id).first()
+    return verify_access_token(token, credentials_exception)
+
+def get_current_user(request: Request, db: Session = Depends(database.get_db)):
+    token = get_token_data(request)
+    user = load_user(db, int(token.id))
+    return user
+
+# For routes running on the event loop with an AsyncSession
+async def get_current_user_async(request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    token = get_token_data(request)
+    user = await load_user_async(db, int(token.id))
     return user
 
 # For WebSocket
-async def get_current_user_ws(websocket: WebSocket, db: Session = Depends(database.get_db)):
+async def get_current_user_ws(websocket: WebSocket, db: AsyncSession = Depends(database.get_async_db)):
     try:
         token = websocket.cookies.get("access_token")
         if not token:
@@ -67,7 +96,7 @@ async def get_current_user_ws(websocket: WebSocket, db: Session = Depends(databa
             headers={"WWW-Authenticate": "Bearer"},
         )
         token = verify_access_token(token, credentials_exception)
-        user = db.query(models.User).filter(models.User.id == token.id).first()
+        user = await load_user_async(db, int(token.id))
         if not user:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             raise HTTPException(
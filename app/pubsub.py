@@ -0,0 +1,138 @@
+from typing import Callable, Dict
+import asyncio
+import logging
+import threading
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from .config import settings
+from .database import SQLALCHEMY_DATABASE_URL
+
+# Called with (event_id, message_json) for every message published to a subscribed event
+Callback = Callable[[int, str], None]
+
+
+class PubSubBackend:
+    name = "base"
+
+    async def subscribe(self, event_id: int, callback: Callback):
+        raise NotImplementedError
+
+    async def unsubscribe(self, event_id: int):
+        raise NotImplementedError
+
+    async def publish(self, event_id: int, message_json: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemoryPubSub(PubSubBackend):
+    # Single-process backend: publishing delivers straight to the local subscriber
+    name = "memory"
+
+    def __init__(self):
+        self.callbacks: Dict[int, Callback] = {}
+
+    async def subscribe(self, event_id: int, callback: Callback):
+        self.callbacks[event_id] = callback
+
+    async def unsubscribe(self, event_id: int):
+        self.callbacks.pop(event_id, None)
+
+    async def publish(self, event_id: int, message_json: str):
+        callback = self.callbacks.get(event_id)
+        if callback:
+            callback(event_id, message_json)
+
+
+class PostgresPubSub(PubSubBackend):
+    # Fans out through LISTEN/NOTIFY so every worker and container sees every message.
+    # One listening connection per worker, one LISTEN per event with local sockets.
+    name = "postgres"
+    channel_prefix = "chat_event_"
+    max_payload_bytes = 7999
+
+    def __init__(self, dsn: str = SQLALCHEMY_DATABASE_URL, channel_prefix: str = channel_prefix):
+        self.dsn = dsn
+        self.channel_prefix = channel_prefix
+        self.callbacks: Dict[int, Callback] = {}
+        self.listen_conn = None
+        self.publish_conn = None
+        self.publish_lock = threading.Lock()
+
+    def _channel(self, event_id: int):
+        return f"{self.channel_prefix}{int(event_id)}"
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        return conn
+
+    def _execute(self, conn, sql: str, params=None):
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _ensure_listener(self):
+        if self.listen_conn is None or self.listen_conn.closed:
+            self.listen_conn = await self._run(self._connect)
+            asyncio.get_running_loop().add_reader(self.listen_conn.fileno(), self._on_notify)
+            for event_id in self.callbacks:
+                await self._run(self._execute, self.listen_conn, f"LISTEN {self._channel(event_id)}")
+
+    def _on_notify(self):
+        try:
+            self.listen_conn.poll()
+        except psycopg2.Error as e:
+            logging.error(f"Lost pub/sub listener connection: {e}")
+            asyncio.get_running_loop().remove_reader(self.listen_conn.fileno())
+            self.listen_conn = None
+            asyncio.create_task(self._ensure_listener())
+            return
+        while self.listen_conn.notifies:
+            notify = self.listen_conn.notifies.pop(0)
+            event_id = int(notify.channel[len(self.channel_prefix):])
+            callback = self.callbacks.get(event_id)
+            if callback:
+                callback(event_id, notify.payload)
+
+    async def subscribe(self, event_id: int, callback: Callback):
+        await self._ensure_listener()
+        self.callbacks[event_id] = callback
+        await self._run(self._execute, self.listen_conn, f"LISTEN {self._channel(event_id)}")
+
+    async def unsubscribe(self, event_id: int):
+        if self.callbacks.pop(event_id, None) and self.listen_conn is not None:
+            await self._run(self._execute, self.listen_conn, f"UNLISTEN {self._channel(event_id)}")
+
+    def _notify(self, channel: str, message_json: str):
+        with self.publish_lock:
+            if self.publish_conn is None or self.publish_conn.closed:
+                self.publish_conn = self._connect()
+            self._execute(self.publish_conn, "SELECT pg_notify(%s, %s)", (channel, message_json))
+
+    async def publish(self, event_id: int, message_json: str):
+        if len(message_json.encode()) > self.max_payload_bytes:
+            logging.error(f"Dropping message for {self._channel(event_id)}: payload exceeds NOTIFY limit")
+            return
+        await self._run(self._notify, self._channel(event_id), message_json)
+
+    async def close(self):
+        if self.listen_conn is not None and not self.listen_conn.closed:
+            asyncio.get_running_loop().remove_reader(self.listen_conn.fileno())
+            self.listen_conn.close()
+        if self.publish_conn is not None and not self.publish_conn.closed:
+            self.publish_conn.close()
+        self.listen_conn = None
+        self.publish_conn = None
+
+
+def get_pubsub_backend(name: str = settings.chat_pubsub_backend, channel_prefix: str = PostgresPubSub.channel_prefix) -> PubSubBackend:
+    if name == "postgres":
+        return PostgresPubSub(channel_prefix=channel_prefix)
+    if name == "memory":
+        return InMemoryPubSub()
+    raise ValueError(f"Unknown pub/sub backend: {name}")
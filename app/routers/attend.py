@@ -1,6 +1,8 @@
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Form
-from .. import schemas, database, models, oauth2
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Form, Request
+from .. import schemas, database, models, oauth2, event_summary, versions
+from ..live import feed_updates, participants_messages
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 
@@ -11,24 +13,58 @@ router = APIRouter(
 
 templates = Jinja2Templates(directory = "templates")
 
-@router.post("/", response_class = HTMLResponse, status_code=status.HTTP_201_CREATED)
-def attend(event_id: int = Form(...), 
-           db: Session = Depends(database.get_db), current_user: int = Depends(oauth2.get_current_user)):
-    attend_query = db.query(models.Attend).filter(models.Attend.event_id == event_id, models.Attend.user_id == current_user.id)
-    found_attend = attend_query.first()
-    if not found_attend:
-        new_attend = models.Attend(event_id=event_id, user_id=current_user.id)
-        db.add(new_attend)
-        db.commit()
-        response = HTMLResponse(status_code = status.HTTP_201_CREATED)
-        response.headers['hx-redirect'] = '/events'
-        return response
-    else:
-        attend_query.delete(synchronize_session=False)
-        db.commit()
-        response = HTMLResponse(status_code = status.HTTP_201_CREATED)
-        response.headers['hx-redirect'] = '/events'
-        return response
 
+async def run_attend_statement(db: AsyncSession, statement, event_id: int, direction: int):
+    try:
+        row = (await db.execute(statement)).first()
+    except IntegrityError:
+        # The attend insert hit the events foreign key
+        row = None
+    if row is None:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"event with id: {event_id} was not found")
+    participants, changed, audience = row
+    # Repeated joins/leaves change nothing and keep cached pages valid
+    if changed:
+        await versions.bump_async(db, versions.event_key(event_id))
+    await db.commit()
+    if changed:
+        # Open feeds that may see this event patch its count in place
+        await feed_updates.publish(*participants_messages(event_id, participants, direction * changed, audience))
+    return participants, changed
 
 
+def attend_button(request: Request, event_id: int, attending: bool, participants: int):
+    # The new button replaces the form; the participant count is swapped out of band
+    return templates.TemplateResponse("attend_button.html", {
+        "request": request,
+        "event_id": event_id,
+        "attending": attending,
+        "participants": participants,
+        "oob": True
+    })
+
+
+@router.post("/{event_id}/join", response_class = HTMLResponse)
+async def join(request: Request, event_id: int,
+               db: AsyncSession = Depends(database.get_async_db), current_user: int = Depends(oauth2.get_current_user_async)):
+    participants, _ = await run_attend_statement(db, event_summary.join_statement(event_id, current_user.id), event_id, 1)
+    return attend_button(request, event_id, True, participants)
+
+
+@router.post("/{event_id}/leave", response_class = HTMLResponse)
+async def leave(request: Request, event_id: int,
+                db: AsyncSession = Depends(database.get_async_db), current_user: int = Depends(oauth2.get_current_user_async)):
+    participants, _ = await run_attend_statement(db, event_summary.leave_statement(event_id, current_user.id), event_id, -1)
+    return attend_button(request, event_id, False, participants)
+
+
+@router.post("/", response_class = HTMLResponse)
+async def attend(request: Request, event_id: int = Form(...),
+           db: AsyncSession = Depends(database.get_async_db), current_user: int = Depends(oauth2.get_current_user_async)):
+    # Toggle for forms that don't know the current state: leave if attending, otherwise join
+    participants, left = await run_attend_statement(db, event_summary.leave_statement(event_id, current_user.id), event_id, -1)
+    if left:
+        return attend_button(request, event_id, False, participants)
+    participants, _ = await run_attend_statement(db, event_summary.join_statement(event_id, current_user.id), event_id, 1)
+    return attend_button(request, event_id, True, participants)
@@ -1,7 +1,10 @@
 from fastapi import APIRouter, Depends, status, HTTPException, Response
-from sqlalchemy.orm import Session
-from ..database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db
 from .. import schemas, models, utils, oauth2
+from ..hashing import password_hasher
+from ..user_cache import user_cache
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
 from fastapi.responses import HTMLResponse
 
@@ -9,14 +12,22 @@ from fastapi.responses import HTMLResponse
 router = APIRouter(tags = ['Authentication'])
 
 @router.post('/login', response_class = HTMLResponse)
-def login(user_credentials : OAuth2PasswordRequestForm = Depends(), db : Session = Depends(get_db)):
+async def login(user_credentials : OAuth2PasswordRequestForm = Depends(), db : AsyncSession = Depends(get_async_db)):
 
-    user = db.query(models.User).filter(models.User.email == user_credentials.username).first()
+    user = await db.scalar(select(models.User).where(models.User.email == user_credentials.username))
 
-    if not user or not utils.verify(user_credentials.password, user.password):
+    if user:
+        valid, new_hash = await password_hasher.verify_and_update(user_credentials.password, user.password)
+    if not user or not valid:
         content = '<div class="mb-7 text-center text-red-500 text-xl font-bold" >Wrong email or password</div>'
         response =  HTMLResponse(content = content, status_code = status.HTTP_403_FORBIDDEN)
         return response
+
+    # Stored hash used an outdated bcrypt cost, replace it now that we know the password
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
+        user_cache.invalidate(user.id)
     
     # create a token
 
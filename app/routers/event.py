@@ -1,28 +1,23 @@
-from .. import models, schemas
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Request, Form, File, UploadFile
-from starlette.responses import HTMLResponse, RedirectResponse, JSONResponse
+from .. import models, schemas, utils, event_summary, search, invitations, uploads, versions
+from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Request, Form, File, UploadFile, Query
+from starlette.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from sqlalchemy.orm import aliased
 from sqlalchemy.orm import Session
-from ..database import get_db
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_db, get_async_db
+from typing import Dict, List, Optional, Tuple
 from .. import oauth2
-from sqlalchemy import func, case
+from sqlalchemy import func, case, tuple_, select
 from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
 from datetime import datetime
 import os
 from fastapi.staticfiles import StaticFiles
-import spacy
 from ..config import settings 
-
-nlp = spacy.load("en_core_web_sm")
-
-def auto_generate_tags(description):
-    doc = nlp(description)
-    entity_labels = ["PERSON", "ORG", "GPE", "EVENT", "NORP", "WORK_OF_ART", "LANGUAGE", "FAC", "PRODUCT", "LOC"]
-    tags = [ent.text for ent in doc.ents if ent.label_ in entity_labels]
-    
-    
-    return list(set(tags))  # Remove duplicates
+from ..tagging import tagging_worker, TAG_PENDING
+from ..media import media_store
+from ..fragment_cache import fragment_cache
+from ..live import feed_updates, participants_messages, new_event_messages
 
 router = APIRouter(
     prefix = "/events",
@@ -30,157 +25,243 @@ router = APIRouter(
 )
 
 templates = Jinja2Templates(directory = "templates")
+templates.env.globals["thumbnail"] = uploads.thumbnail
 router.mount("/static", StaticFiles(directory="static"), name="static")
 
 
-@router.get('/partial', response_class=HTMLResponse)
-def get_events_partial(
-    request: Request,
-    db: Session = Depends(get_db),
-    current_user: int = Depends(oauth2.get_current_user),
-    search_query: str = None,
-    event_type: str = "public"  # New query parameter to distinguish between public and invited events
-):
-    ParticipantUser = aliased(models.User)
-    HostUser = aliased(models.User)
-    
-    now = datetime.utcnow()  # Get the current time in UTC
-    
+async def get_feed_page(db: AsyncSession, current_user: models.User, event_type: str, search_query: Optional[str], cursor: Optional[str], now: datetime):
+    # One keyset page of the feed ordered by (event_time, id). Only ids and whether the viewer
+    # attends each event are read here; the cards themselves come from load_feed_events.
+    base_query = select(
+        models.EventSummary.event_id,
+        models.EventSummary.event_time,
+        models.EventSummary.participant_ids.contains([current_user.id]).label("has_attended")
+    ).join(
+        models.Event, models.Event.id == models.EventSummary.event_id
+    ).filter(
+        models.EventSummary.event_time >= now
+    )
+
     # Determine if we are fetching public or invited events
     if event_type == "invited":
-        invited_event_ids = db.query(models.Invitation.event_id).filter(models.Invitation.user_id == current_user.id)
-        base_query = db.query(
-            models.Event,
-            func.count(models.Attend.event_id).label("participants"),
-            func.array_agg(ParticipantUser.email).label("participants_emails"),
-            func.array_agg(ParticipantUser.id).label("participants_ids"),  # Add participant IDs
-            HostUser.email.label("host_email"),
-            models.Event.picture,
-            models.Event.tags
-        ).join(
-            models.Attend, models.Attend.event_id == models.Event.id, isouter=True
-        ).join(
-            HostUser, HostUser.id == models.Event.host_id
-        ).join(
-            ParticipantUser, ParticipantUser.id == models.Attend.user_id, isouter=True
-        ).filter(
-            models.Event.event_time >= now,
-            models.Event.id.in_(invited_event_ids)  # Filter for invited events
-        )
+        base_query = base_query.filter(models.EventSummary.invited_user_ids.contains([current_user.id]))  # Filter for invited events
     else:
-        base_query = db.query(
-            models.Event,
-            func.count(models.Attend.event_id).label("participants"),
-            func.array_agg(ParticipantUser.email).label("participants_emails"),
-            func.array_agg(ParticipantUser.id).label("participants_ids"),  # Add participant IDs
-            HostUser.email.label("host_email"),
-            models.Event.picture,
-            models.Event.tags
-        ).join(
-            models.Attend, models.Attend.event_id == models.Event.id, isouter=True
-        ).join(
-            HostUser, HostUser.id == models.Event.host_id
-        ).join(
-            ParticipantUser, ParticipantUser.id == models.Attend.user_id, isouter=True
-        ).filter(
-            models.Event.event_time >= now,
-            models.Event.public == True  # Filter for public events
-        )
+        base_query = base_query.filter(models.EventSummary.public == True)  # Filter for public events
     
-    # Apply search filter
+    # Apply search filter (full-text, tags and typo-tolerant title match, all index-backed)
     if search_query:
-        search = f"%{search_query}%"
+        search_clause, _ = search.search_filter(search_query)
+        base_query = base_query.filter(search_clause)
+
+    if cursor:
+        try:
+            after_time, after_id = utils.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
         base_query = base_query.filter(
-            (models.Event.title.ilike(search)) |
-            (models.Event.location.ilike(search)) |
-            (models.Event.tags.any(search_query.upper()))
+            tuple_(models.EventSummary.event_time, models.EventSummary.event_id) > tuple_(after_time, after_id)
         )
-    
-    results = base_query.group_by(
-        models.Event.id, HostUser.email, models.Event.picture, models.Event.tags
+
+    # Fetch one extra row to know whether another page exists
+    page_size = settings.events_page_size
+    results = (await db.execute(base_query.order_by(
+        models.EventSummary.event_time.asc(),
+        models.EventSummary.event_id.asc()
+    ).limit(page_size + 1))).all()
+    next_cursor = None
+    if len(results) > page_size:
+        results = results[:page_size]
+        next_cursor = utils.encode_cursor(results[-1].event_time, results[-1].event_id)
+    return [(row.event_id, row.has_attended) for row in results], next_cursor
+
+
+async def get_top_event_ids(db: AsyncSession, now: datetime) -> List[int]:
+    # Top three public events with the most participants, without search filter; the same for everyone
+    return (await db.execute(select(models.EventSummary.event_id).filter(
+        models.EventSummary.public == True,
+        models.EventSummary.event_time >= now
     ).order_by(
-        models.Event.event_time.asc()
-    ).all()
-    
-    # Separate query for top three public events with the most participants, without search filter
-    top_events_query = db.query(
+        models.EventSummary.participant_count.desc(),
+        models.EventSummary.event_id.asc()
+    ).limit(3))).scalars().all()
+
+
+async def load_feed_events(db: AsyncSession, event_ids: List[int], search_query: Optional[str] = None) -> Dict[int, dict]:
+    # Card data by event id; participant counts, ids and host emails come from the
+    # precomputed event_summary read model, so nothing aggregates over attends
+    if not event_ids:
+        return {}
+    results = (await db.execute(select(
         models.Event,
-        func.count(models.Attend.event_id).label("participants"),
-        func.array_agg(ParticipantUser.email).label("participants_emails"),
-        func.array_agg(ParticipantUser.id).label("participants_ids"),  # Add participant IDs
-        HostUser.email.label("host_email"),
-        models.Event.picture,
-        models.Event.tags
-    ).join(
-        models.Attend, models.Attend.event_id == models.Event.id, isouter=True
-    ).join(
-        HostUser, HostUser.id == models.Event.host_id
+        models.EventSummary
     ).join(
-        ParticipantUser, ParticipantUser.id == models.Attend.user_id, isouter=True
+        models.EventSummary, models.EventSummary.event_id == models.Event.id
     ).filter(
-        models.Event.event_time >= now,
-        models.Event.public == True  # Filter for public events
-    ).group_by(
-        models.Event.id, HostUser.email, models.Event.picture, models.Event.tags
-    ).order_by(
-        func.count(models.Attend.event_id).desc()
-    ).limit(3)
-    
-    top_events = top_events_query.all()
-    
+        models.Event.id.in_(event_ids)
+    ))).all()
+    return {
+        event.id: {
+            "event": schemas.EventResponse.from_orm(event),
+            "participants": summary.participant_count,
+            "participants_ids": summary.participant_ids,
+            "host_email": summary.host_email,
+            "picture": event.picture,
+            "tags": event.tags,
+            "matched_tags": search.matched_tags(event.tags, search_query)
+        }
+        for event, summary in results
+    }
+
+
+def render_fragment(request: Request, name: str, context: dict) -> Markup:
+    return Markup(templates.get_template(name).render({"request": request, **context}))
+
+
+async def render_feed_cards(request: Request, db: AsyncSession, page: List[Tuple[int, bool]], stamps: Dict[str, int],
+                            event_type: str, search_query: Optional[str], next_cursor: Optional[str]) -> Markup:
+    # Each card is cached on its own event's version and the viewer's attend state, so a
+    # write re-renders only the card it changed and viewers share every other card
+    keys = [
+        ("event_card", event_id, stamps[versions.event_key(event_id)], has_attended, search_query or "")
+        for event_id, has_attended in page
+    ]
+
+    async def render(missing):
+        events = await load_feed_events(db, [key[1] for key in missing], search_query)
+        return {
+            key: render_fragment(request, "event_card.html", {"event_data": {**events[key[1]], "has_attended": key[3]}})
+            for key in missing if key[1] in events
+        }
+    cards = await fragment_cache.get_or_render_many(keys, render)
+    return render_fragment(request, "event_cards.html", {
+        "cards": [cards[key] for key in keys if key in cards],
+        "event_type": event_type,
+        "search_query": search_query,
+        "next_cursor": next_cursor
+    })
+
+
+async def render_top_events(request: Request, db: AsyncSession, top_event_ids: List[int], stamps: Dict[str, int]) -> Markup:
+    async def render():
+        events = await load_feed_events(db, top_event_ids)
+        return render_fragment(request, "top_events.html", {"top_events": [events[event_id] for event_id in top_event_ids if event_id in events]})
+    key = ("top_events", tuple((event_id, stamps[versions.event_key(event_id)]) for event_id in top_event_ids))
+    return await fragment_cache.get_or_render(key, render)
+
+
+@router.get('/partial', response_class=HTMLResponse)
+async def get_events_partial(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: int = Depends(oauth2.get_current_user_async),
+    search_query: str = None,
+    event_type: str = "public"  # New query parameter to distinguish between public and invited events
+):
+    now = datetime.utcnow()  # Get the current time in UTC
+    minute = now.strftime("%Y%m%d%H%M")
+
+    # The validator is derived from what the page shows: the ids, versions and attend
+    # state of the first page and the top events, plus the feed membership counters
+    # behind the badge counts. The minute is part of it because events drop out of the
+    # feed once they start. Only the first page is rendered here; the rest is loaded
+    # by /events/partial/more.
+    page, next_cursor = await get_feed_page(db, current_user, event_type, search_query, None, now)
+    top_event_ids = await get_top_event_ids(db, now)
+    stamps = await versions.read_versions(
+        db, versions.PUBLIC_FEED, versions.INVITED_FEED,
+        *dict.fromkeys(versions.event_key(event_id) for event_id in [event_id for event_id, _ in page] + top_event_ids)
+    )
+    etag = versions.make_etag("feed", current_user.id, event_type, search_query, minute, next_cursor, page, top_event_ids, sorted(stamps.items()))
+    if versions.is_not_modified(request, etag):
+        return versions.not_modified(etag)
+
+    # Cards and the sidebar come from the fragment cache unless an event they show was written since
+    cards_html = await render_feed_cards(request, db, page, stamps, event_type, search_query, next_cursor)
+    top_events_html = await render_top_events(request, db, top_event_ids, stamps)
+
     # Query to count public and invited events
-    public_events_count = db.query(models.Event).filter(
-        models.Event.public == True,
-        models.Event.event_time >= now  # Filter for non-outdated public events
-    ).count()
-    
-    invited_events_count = db.query(models.Invitation).join(
-        models.Event, models.Event.id == models.Invitation.event_id
-    ).filter(
-        models.Invitation.user_id == current_user.id,
-        models.Event.event_time >= now  # Filter for non-outdated invited events
-    ).count()
-    
-    events_with_participants = []
-    for event, participants, participants_emails, participants_ids, host_email, picture, tags in results:
-        event_response = schemas.EventResponse.from_orm(event)
-        participants_emails = [email for email in participants_emails]
-        participants_ids = [pid for pid in participants_ids]  
-        has_attended = current_user.id in participants_ids  
-        events_with_participants.append({
-            "event": event_response,
-            "participants": participants,
-            "participants_emails": participants_emails,
-            "participants_ids": participants_ids,
-            "host_email": host_email,
-            "picture": picture,
-            "tags": tags,
-            "has_attended": has_attended  
-        })
-    
-    top_events_with_participants = []
-    for event, participants, participants_emails, participants_ids, host_email, picture, tags in top_events:
-        event_response = schemas.EventResponse.from_orm(event)
-        top_events_with_participants.append({
-            "event": event_response,
-            "participants": participants,
-            "participants_emails": participants_emails,
-            "participants_ids": participants_ids,
-            "host_email": host_email,
-            "picture": picture,
-            "tags": tags
-        })
-    
-    return templates.TemplateResponse("events_partial.html", {
+    async def count_public():
+        return await db.scalar(select(func.count()).select_from(models.EventSummary).filter(
+            models.EventSummary.public == True,
+            models.EventSummary.event_time >= now  # Filter for non-outdated public events
+        ))
+
+    async def count_invited():
+        return await db.scalar(select(func.count()).select_from(models.EventSummary).filter(
+            models.EventSummary.invited_user_ids.contains([current_user.id]),
+            models.EventSummary.event_time >= now  # Filter for non-outdated invited events
+        ))
+
+    public_events_count = await fragment_cache.get_or_render(("public_count", stamps[versions.PUBLIC_FEED], minute), count_public)
+    invited_events_count = await fragment_cache.get_or_render(("invited_count", stamps[versions.INVITED_FEED], minute, current_user.id), count_invited)
+
+    response = templates.TemplateResponse("events_partial.html", {
         "request": request,
-        "events": events_with_participants,
-        "top_events": top_events_with_participants,
+        "cards_html": cards_html,
+        "top_events_html": top_events_html,
         "user": current_user,
         "base_url": settings.base_url,
         "event_type": event_type,  # Pass the event type to the template
+        "search_query": search_query,
         "public_events_count": public_events_count,  # Pass the count of public events
         "invited_events_count": invited_events_count  # Pass the count of invited events
     })
+    return versions.set_validators(response, etag)
+
+
+@router.get('/partial/more', response_class=HTMLResponse)
+async def get_events_partial_more(
+    request: Request,
+    cursor: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: int = Depends(oauth2.get_current_user_async),
+    search_query: str = None,
+    event_type: str = "public"
+):
+    # "Load more" fragment: the next page of cards plus the trigger for the page after it
+    page, next_cursor = await get_feed_page(db, current_user, event_type, search_query, cursor, datetime.utcnow())
+    stamps = await versions.read_versions(db, *(versions.event_key(event_id) for event_id, _ in page))
+    cards_html = await render_feed_cards(request, db, page, stamps, event_type, search_query, next_cursor)
+    return HTMLResponse(cards_html)
+
+
+@router.get('/search', response_class=JSONResponse)
+def search_events(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    # Ranked search over upcoming events the user can see, with the tags that matched
+    search_clause, rank = search.search_filter(q)
+    invited_event_ids = db.query(models.Invitation.event_id).filter(models.Invitation.user_id == current_user.id)
+    results = db.query(
+        models.Event,
+        rank.label("rank")
+    ).filter(
+        search_clause,
+        models.Event.event_time >= datetime.utcnow(),
+        (models.Event.public == True) | models.Event.id.in_(invited_event_ids)
+    ).order_by(
+        rank.desc(),
+        models.Event.event_time.asc()
+    ).limit(limit).all()
+
+    return {
+        "query": q,
+        "results": [
+            {
+                "id": event.id,
+                "title": event.title,
+                "location": event.location,
+                "event_time": event.event_time,
+                "tags": event.tags,
+                "matched_tags": search.matched_tags(event.tags, q),
+                "rank": rank_value
+            }
+            for event, rank_value in results
+        ]
+    }
 
 
 @router.get('/', response_class=HTMLResponse)
@@ -188,59 +269,149 @@ def events_page(request: Request, db: Session = Depends(get_db), current_user: i
     return templates.TemplateResponse("events.html", {"request": request, "user": current_user})
 
 
+@router.get('/stream')
+async def feed_stream(request: Request, current_user: models.User = Depends(oauth2.get_current_user)):
+    # Server-Sent Events for the open feed: participant counts and new events (see app/live.py)
+    return StreamingResponse(
+        feed_updates.stream(request, current_user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get('/{id}', response_class=HTMLResponse)
-def get_event(
+async def get_event(
     id: int,
     request: Request,
-    db: Session = Depends(get_db),
-    current_user: int = Depends(oauth2.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: int = Depends(oauth2.get_current_user_async)
 ):
-    ParticipantUser = aliased(models.User, name="participant_user")
-    HostUser = aliased(models.User, name="host_user")
+    event_version = (await versions.read_versions(db, versions.event_key(id)))[versions.event_key(id)]
+    etag = versions.make_etag("event", id, event_version, current_user.id)
+    if versions.is_not_modified(request, etag):
+        return versions.not_modified(etag)
 
-    result = db.query(
-        models.Event,
-        func.count(models.Attend.event_id).label("participants"),
-        func.array_agg(ParticipantUser.email).label("participants_emails"),
-        func.array_agg(ParticipantUser.id).label("participants_ids"),
-        HostUser.email.label("host_email")  # Get host email
-    ).join(
-        models.Attend, models.Attend.event_id == models.Event.id, isouter=True
-    ).join(
-        ParticipantUser, ParticipantUser.id == models.Attend.user_id, isouter=True
-    ).join(
-        HostUser, HostUser.id == models.Event.host_id
-    ).filter(
-        models.Event.id == id
-    ).group_by(
-        models.Event.id, HostUser.email  # Group by event id and host email
-    ).first()
+    # The page only depends on the viewer through the Join/Leave button
+    has_attended = await db.get(models.Attend, (current_user.id, id)) is not None
 
-    if not result:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Event with id: {id} was not found.')
+    async def render():
+        ParticipantUser = aliased(models.User, name="participant_user")
+        HostUser = aliased(models.User, name="host_user")
 
-    event, participants, participants_emails, participants_ids, host_email = result
-    participants_ids = [pid for pid in participants_ids if pid is not None]
-    participants_emails = [email for email in participants_emails if email is not None]
+        result = (await db.execute(select(
+            models.Event,
+            func.count(models.Attend.event_id).label("participants"),
+            func.array_agg(ParticipantUser.email).label("participants_emails"),
+            func.array_agg(ParticipantUser.id).label("participants_ids"),
+            HostUser.email.label("host_email")  # Get host email
+        ).join(
+            models.Attend, models.Attend.event_id == models.Event.id, isouter=True
+        ).join(
+            ParticipantUser, ParticipantUser.id == models.Attend.user_id, isouter=True
+        ).join(
+            HostUser, HostUser.id == models.Event.host_id
+        ).filter(
+            models.Event.id == id
+        ).group_by(
+            models.Event.id, HostUser.email  # Group by event id and host email
+        ))).first()
+
+        if not result:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Event with id: {id} was not found.')
 
-    event_response = schemas.EventResponse.from_orm(event)
+        event, participants, participants_emails, participants_ids, host_email = result
+        participants_ids = [pid for pid in participants_ids if pid is not None]
+        participants_emails = [email for email in participants_emails if email is not None]
+
+        event_response = schemas.EventResponse.from_orm(event)
+
+        # Create zipped data for participants
+        participants_data = list(zip(participants_emails, participants_ids))
+
+        return render_fragment(request, "event_detail.html", {
+            "event": event_response,
+            "participants": participants,
+            "participants_data": participants_data,  # Pass the zipped data
+            "host_email": host_email,  # Pass host email to template
+            "has_attended": has_attended  # Pass attendance status
+        })
+
+    html = await fragment_cache.get_or_render(("event_detail", id, event_version, has_attended), render)
+    return versions.set_validators(HTMLResponse(html), etag)
+
+@router.get('/{id}/tags', response_class=JSONResponse)
+def get_event_tags(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+    event = db.query(models.Event.tags, models.Event.tag_status).filter(models.Event.id == id).first()
+    if not event:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Event with id: {id} was not found.')
+    return {"tags": event.tags or [], "tag_status": event.tag_status}
 
-    # Create zipped data for participants
-    participants_data = list(zip(participants_emails, participants_ids))
+def get_hosted_event(db: Session, id: int, current_user: models.User):
+    event = db.query(models.Event).filter(models.Event.id == id).first()
+    if event is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Event with id: {id} does not exist.")
+    if event.host_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action")
+    return event
 
-    # Check if the current user has attended the event
-    has_attended = current_user.id in participants_ids
+@router.get('/{id}/invitable', response_class=HTMLResponse)
+def get_invitable_users(
+    id: int,
+    request: Request,
+    q: Optional[str] = None,
+    after: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    # Checkbox list of users the host can still invite, loaded lazily by the profile page
+    get_hosted_event(db, id, current_user)
 
-    context = {
+    users, next_after = invitations.invitable_users(db, id, current_user.id, q, after, settings.invitable_users_page_size)
+    return templates.TemplateResponse("invitable_users.html", {
         "request": request,
-        "event": event_response,
-        "participants": participants,
-        "participants_data": participants_data,  # Pass the zipped data
-        "host_email": host_email,  # Pass host email to template
-        "has_attended": has_attended  # Pass attendance status
-    }
+        "event_id": id,
+        "users": users,
+        "search_query": q,
+        "after": after,
+        "next_after": next_after
+    })
 
-    return templates.TemplateResponse("event_detail.html", context)
+@router.post('/{id}/invitations', response_model=schemas.BulkEmailsResult)
+def invite_users(
+    id: int,
+    body: schemas.BulkEmails,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    # Bulk invite by email; unknown emails are reported, not fatal
+    event = get_hosted_event(db, id, current_user)
+    result, invited = invitations.invite_emails(db, id, body.emails)
+    versions.bump(db, versions.event_key(id), versions.INVITED_FEED)
+    db.commit()
+    # A private event just appeared on the new invitees' feeds
+    if not event.public:
+        feed_updates.notify(*new_event_messages(id, False, invited))
+    return result
+
+@router.post('/{id}/attendees/import', response_model=schemas.BulkEmailsResult)
+def import_attendees(
+    id: int,
+    body: schemas.BulkEmails,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    # Bulk attendance import for hosts, e.g. from a sign-up sheet
+    event = get_hosted_event(db, id, current_user)
+    result = invitations.import_attendees(db, id, body.emails, event.public)
+    # Attendees of a private event are invited as well
+    versions.bump(db, versions.event_key(id), versions.INVITED_FEED)
+    db.commit()
+    if result["added"]:
+        count, audience = db.execute(
+            select(models.EventSummary.participant_count, event_summary.audience()).where(models.EventSummary.event_id == id)
+        ).one()
+        feed_updates.notify(*participants_messages(id, count, len(result["added"]), audience))
+    return result
 
 @router.post('/create_event', response_class=HTMLResponse)
 def create_event(
@@ -258,69 +429,60 @@ def create_event(
 ):
     event_time = datetime.fromisoformat(event_time)
     
-    auto_tags = auto_generate_tags(description)
-    print("Auto-generated tags:", auto_tags)  # Debugging
-    
-    # Combine provided tags with auto-generated tags
+    # Store the provided tags now; the tagging worker adds the auto-generated ones afterwards
     if tags:
         provided_tags = [tag.strip().upper() for tag in tags.split(',')]
     else:
         provided_tags = []
+    tags_list = list(dict.fromkeys(provided_tags))
     
-    # Combine and remove duplicates while ensuring all tags are uppercase and without quotation marks
-    tags_set = set(provided_tags + auto_tags)
-    tags_list = [tag.upper() for tag in tags_set]
-    
+    # Everything below is one transaction: flush for the id, stage the rest, commit once
     new_event = models.Event(
         title=title,
         description=description,
         event_time=event_time,
         location=location,
-        picture=None,  # Temporarily set to None
         tags=tags_list,
         host_id=current_user.id,
-        public=public  # Set the public field
+        public=public,  # Set the public field
+        # Claimed by this worker, which submits it below
+        tag_status=TAG_PENDING,
+        tag_claimed_at=func.now()
     )
-    db.add(new_event)
-    db.commit()
-    db.refresh(new_event)
-
-    # Rename and save the picture using event_id
-    if picture:
-        picture_filename = f"{new_event.id}_pic{os.path.splitext(picture.filename)[1]}"
-        picture_path = os.path.join("static/images", picture_filename)
-        with open(picture_path, "wb") as buffer:
-            buffer.write(picture.file.read())
-        new_event.picture = f"static/images/{picture_filename}"
+    # Staged by content before the transaction and published only after the commit
+    staged_picture = None
+    if picture and picture.filename:
+        staged_picture = media_store.stage(picture, os.path.splitext(picture.filename)[1])
+        new_event.picture = staged_picture.path
+
+    try:
+        db.add(new_event)
+        db.flush()
+        event_id = new_event.id
+        event_summary.create_summary(db, new_event, current_user.email)
+
+        # The host attends their own event
+        db.add(models.Attend(event_id=event_id, user_id=current_user.id))
+        event_summary.add_participant(db, event_id, current_user.id)
+
+        # Handle invitees for private events; the host is always invited
+        invited_user_ids = []
+        if not public:
+            invitations.invite_emails(db, event_id, (invitees or []) + [current_user.email])
+            invited_user_ids = db.scalar(select(models.EventSummary.invited_user_ids).where(models.EventSummary.event_id == event_id))
+
+        versions.bump(db, versions.event_key(event_id), versions.feed_key(public))
         db.commit()
+    except Exception:
+        db.rollback()
+        media_store.discard(staged_picture)
+        raise
+    if staged_picture and media_store.publish(staged_picture):
+        uploads.thumbnailer.submit(staged_picture.path)
+    # Open feeds offer to load it; private events only reach their invitees
+    feed_updates.notify(*new_event_messages(event_id, public, invited_user_ids or []))
 
-    # Check if the host is already attending the event to avoid duplicate key error
-    existing_attendance = db.query(models.Attend).filter(
-        models.Attend.event_id == new_event.id,
-        models.Attend.user_id == current_user.id
-    ).first()
-
-    if not existing_attendance:
-        new_attendance = models.Attend(event_id=new_event.id, user_id=current_user.id)
-        db.add(new_attendance)
-        db.commit()
-        db.refresh(new_attendance)
-
-    # Handle invitees for private events
-    if not public:
-        if invitees is None:
-            invitees = []
-        # Ensure the current user is in the invitees list
-        current_user_email = db.query(models.User).filter(models.User.id == current_user.id).first().email
-        if current_user_email not in invitees:
-            invitees.append(current_user_email)
-
-        for email in invitees:
-            user = db.query(models.User).filter(models.User.email == email).first()
-            if user:
-                new_invitation = models.Invitation(event_id=new_event.id, user_id=user.id)
-                db.add(new_invitation)
-        db.commit()
+    tagging_worker.submit(event_id)
 
     return RedirectResponse(url="/events", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -360,53 +522,54 @@ def update_event_post(
         "public": public  # Update public status
     }
 
+    # A new description needs new auto-generated tags
+    retag = description != event.description
+    if retag:
+        update_data["tag_status"] = TAG_PENDING
+        update_data["tag_claimed_at"] = func.now()
+
+    staged_picture = None
     if picture and picture.filename:
-        # Remove the old picture file if it exists and a new picture is provided
-        if current_picture and os.path.exists(current_picture):
-            os.remove(current_picture)
-
-        # Save the new picture
-        picture_filename = f"{event.id}_pic{os.path.splitext(picture.filename)[1]}"
-        picture_path = os.path.join("static/images", picture_filename)
-        with open(picture_path, "wb") as buffer:
-            buffer.write(picture.file.read())
-        update_data["picture"] = f"static/images/{picture_filename}"
+        staged_picture = media_store.stage(picture, os.path.splitext(picture.filename)[1])
+        update_data["picture"] = staged_picture.path
     else:
         # Keep the old picture if no new picture is uploaded
         update_data["picture"] = current_picture
 
-    event_query.update(update_data, synchronize_session=False)
-    db.commit()
+    old_picture = event.picture
+    try:
+        event_query.update(update_data, synchronize_session=False)
+        event_summary.sync_event(db, id, event_time, public)
 
-    # Add new invitees only for private events
-    if not public and new_invitees:
-        for email in new_invitees:
-            user = db.query(models.User).filter(models.User.email == email).first()
-            if user:
-                existing_invitation = db.query(models.Invitation).filter(models.Invitation.event_id == id, models.Invitation.user_id == user.id).first()
-                if not existing_invitation:
-                    new_invitation = models.Invitation(event_id=id, user_id=user.id)
-                    db.add(new_invitation)
+        # Add new invitees only for private events
+        invited = []
+        if not public and new_invitees:
+            _, invited = invitations.invite_emails(db, id, new_invitees)
+
+        # Visibility and time may have changed, which moves the event between feeds
+        versions.bump(db, versions.event_key(id), versions.PUBLIC_FEED, versions.INVITED_FEED)
         db.commit()
+    except Exception:
+        db.rollback()
+        media_store.discard(staged_picture)
+        raise
+    if staged_picture and media_store.publish(staged_picture):
+        uploads.thumbnailer.submit(staged_picture.path)
+    if staged_picture and old_picture != staged_picture.path:
+        media_store.release(old_picture)
+    if retag:
+        tagging_worker.submit(id)
+    # The event is new on the new invitees' feeds
+    feed_updates.notify(*new_event_messages(id, False, invited))
 
     user = db.query(models.User).filter(models.User.id == current_user.id).first()
     events = db.query(models.Event).filter(models.Event.host_id == current_user.id).all()
 
-    # Get all users excluding the current user
-    all_users = db.query(models.User).filter(models.User.id != current_user.id).all()
-
-    # Prepare a dictionary to hold non-invited users for each event
-    non_invited_users = {}
-    for event in events:
-        invited_user_ids = db.query(models.Invitation.user_id).filter(models.Invitation.event_id == event.id).all()
-        invited_user_ids = [user_id for (user_id,) in invited_user_ids]
-        non_invited_users[event.id] = [user for user in all_users if user.id not in invited_user_ids]
-
+    # Invitable users are loaded per event by /events/{id}/invitable
     return templates.TemplateResponse("profile.html", {
         "request": request,
         "user": user,
-        "events": events,
-        "non_invited_users": non_invited_users
+        "events": events
     })
 
 @router.delete("/delete/{id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -423,22 +586,17 @@ def delete_event(
     if event.host_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action")
     
-    # Delete related messages first
+    picture = event.picture
+    # Messages, invitations and the event go in one transaction
     db.query(models.Message).filter(models.Message.event_id == id).delete(synchronize_session=False)
-    db.commit()
-
-    # Delete related invitations if necessary
     db.query(models.Invitation).filter(models.Invitation.event_id == id).delete(synchronize_session=False)
-    db.commit()
-
-    # Delete event picture if it exists
-    if event.picture and os.path.exists(event.picture):
-        os.remove(event.picture)
-        
-    # Delete the event
     event_query.delete(synchronize_session=False)
+    versions.bump(db, versions.event_key(id), versions.PUBLIC_FEED, versions.INVITED_FEED)
     db.commit()
 
+    # Only once the event is gone; stored pictures may be shared and are left to media GC
+    media_store.release(picture)
+
     return RedirectResponse(url=f"/{current_user.id}/profile", status_code=status.HTTP_303_SEE_OTHER)
 
 
@@ -460,16 +618,59 @@ def event_chat(request: Request, event_id: int, db: Session = Depends(get_db), c
 
 
 @router.get("/{event_id}/messages", response_class=JSONResponse)
-def get_event_messages(event_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
-    messages = (
-        db.query(models.Message.content, models.Message.timestamp, models.User.email, models.User.id.label('user_id'))
+async def get_event_messages(
+    event_id: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(oauth2.get_current_user_async)
+):
+    # Keyset pagination over (timestamp, id):
+    #   no cursor  -> the latest page
+    #   before     -> the page older than the cursor
+    #   after      -> the page newer than the cursor
+    #   since_id   -> everything a reconnecting client missed after its last seen id
+    query = (
+        select(models.Message.id, models.Message.content, models.Message.timestamp, models.User.email, models.User.id.label('user_id'))
         .join(models.User, models.Message.user_id == models.User.id)
         .filter(models.Message.event_id == event_id)
-        .order_by(models.Message.timestamp.asc())
-        .all()
     )
+    position = tuple_(models.Message.timestamp, models.Message.id)
+
+    try:
+        if since_id is not None:
+            query = query.filter(models.Message.id > since_id)
+            newest_first = False
+        elif after:
+            query = query.filter(position > tuple_(*utils.decode_cursor(after)))
+            newest_first = False
+        elif before:
+            query = query.filter(position < tuple_(*utils.decode_cursor(before)))
+            newest_first = True
+        else:
+            newest_first = True
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if newest_first:
+        query = query.order_by(models.Message.timestamp.desc(), models.Message.id.desc())
+    else:
+        query = query.order_by(models.Message.timestamp.asc(), models.Message.id.asc())
+
+    # Fetch one extra row to know whether another page exists
+    messages = (await db.execute(query.limit(limit + 1))).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if newest_first:
+        messages.reverse()
+
     return {
-        "messages": [ {"content": message.content, "timestamp": message.timestamp, "email": message.email, "user_id": message.user_id} for message in messages ],
+        "messages": [ {"id": message.id, "content": message.content, "timestamp": message.timestamp, "email": message.email, "user_id": message.user_id} for message in messages ],
+        "has_more": has_more,
+        "prev_cursor": utils.encode_cursor(messages[0].timestamp, messages[0].id) if messages else before,
+        "next_cursor": utils.encode_cursor(messages[-1].timestamp, messages[-1].id) if messages else after,
         "current_user_email": current_user.email,
         "current_user_id": current_user.id
     }
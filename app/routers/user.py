@@ -1,8 +1,14 @@
-from .. import models, schemas, utils, oauth2
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Form, UploadFile, File
+from .. import models, schemas, utils, oauth2, invitations, user_search
+from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Form, UploadFile, File, Request
+from fastapi.templating import Jinja2Templates
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from ..database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..config import settings
+from ..database import get_db, get_async_db
+from ..hashing import password_hasher
 from fastapi.responses import HTMLResponse
+from typing import Optional
 from pydantic import EmailStr
 from datetime import date
 import shutil
@@ -14,12 +20,17 @@ router = APIRouter(
     tags = ["Users"]
 )
 
+templates = Jinja2Templates(directory = "templates")
+
+# Checkbox names used by the create (invitees) and edit (new_invitees) event forms
+INVITEE_INPUT_NAMES = ("invitees", "new_invitees")
+
 
 @router.post('/', status_code=status.HTTP_201_CREATED)
-def create_user(email: EmailStr = Form(...),
+async def create_user(email: EmailStr = Form(...),
     password: str = Form(...),
-    birthday: date = Form(...), db : Session = Depends(get_db)):
-    existed_user = db.query(models.User).filter(models.User.email == email).first()
+    birthday: date = Form(...), db : AsyncSession = Depends(get_async_db)):
+    existed_user = await db.scalar(select(models.User.id).where(models.User.email == email))
     if existed_user:
         content = '''
         <div id="error_response1" class="mb-7 text-center text-red-500 text-xl font-bold">Email is already in use</div>
@@ -33,12 +44,10 @@ def create_user(email: EmailStr = Form(...),
         return response
 
     # hash the password - user.password
-    hashed_password = utils.hash(password)
-    password = hashed_password
+    hashed_password = await password_hasher.hash(password)
     new_user = models.User(email=email, password=hashed_password, birthday=birthday)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
     content = '''
     <div class="mb-7 text-center text-green-500 text-xl font-bold">Signup successful! </br> Redirecting to login page...</div>
     <meta http-equiv="refresh" content="3;url=/">
@@ -52,6 +61,42 @@ def create_user(email: EmailStr = Form(...),
 
     return response
 
+@router.get('/search', response_class = HTMLResponse)
+def search_users(
+    request: Request,
+    q: str = "",
+    input_name: str = "invitees",
+    event_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    # Invitee typeahead fragment. Emails already ticked in the form come back as
+    # <input_name>=... and are kept ticked on top of the new matches.
+    if input_name not in INVITEE_INPUT_NAMES:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"Unknown input name: {input_name}")
+    selected = list(dict.fromkeys(request.query_params.getlist(input_name)))
+
+    conditions = []
+    if event_id is not None:
+        event = db.query(models.Event.host_id).filter(models.Event.id == event_id).first()
+        if not event:
+            raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"Event with id: {event_id} was not found.")
+        if event.host_id != current_user.id:
+            raise HTTPException(status_code = status.HTTP_403_FORBIDDEN, detail = "Not authorized to perform requested action")
+        conditions.append(invitations.not_invited_to(event_id))
+
+    users = []
+    if q.strip():
+        users = user_search.search_users(db, q, selected, current_user.id, settings.user_search_limit, *conditions)
+    return templates.TemplateResponse("user_search_results.html", {
+        "request": request,
+        "input_name": input_name,
+        "event_id": event_id,
+        "selected": selected,
+        "users": users,
+        "search_query": q
+    })
+
 @router.get('/{id}', response_model = schemas.UserOut)
 def get_user(id : int, db : Session = Depends(get_db)):
     user = db.query(models.User).filter(models.User.id == id).first()
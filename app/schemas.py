@@ -29,6 +29,7 @@ class EventResponse(BaseModel):
     created_at : datetime
     picture: Optional[str] = None
     tags: Optional[List[str]] = None
+    tag_status: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -105,4 +106,11 @@ class InvitationResponse(BaseModel):
     accepted: bool
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+class BulkEmails(BaseModel):
+    emails: List[str]
+
+class BulkEmailsResult(BaseModel):
+    added: List[str]
+    already_present: List[str]
+    unknown: List[str]
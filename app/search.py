@@ -0,0 +1,61 @@
+from sqlalchemy import func, or_, case, literal, cast, String, text
+from sqlalchemy.dialects.postgresql import array, ARRAY
+from sqlalchemy.engine import Engine
+from typing import List
+import logging
+from . import models
+
+# Event search: full-text over title/description/location (events.search_vector),
+# tag overlap on events.tags, and trigram word similarity on the title for typos
+# when the pg_trgm extension is available.
+
+SEARCH_CONFIG = "english"
+
+trigram_enabled = False
+
+
+def ensure_search_schema(engine: Engine):
+    # create_all only creates missing tables, so existing databases get the
+    # search column and indexes here. Every statement is idempotent.
+    global trigram_enabled
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"ALTER TABLE events ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS ({models.EVENT_SEARCH_VECTOR_SQL}) STORED"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_events_search_vector ON events USING gin (search_vector)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_events_tags ON events USING gin (tags)"))
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_events_title_trgm ON events USING gin (title gin_trgm_ops)"))
+        trigram_enabled = True
+    except Exception as e:
+        logging.warning(f"pg_trgm is unavailable, event search runs without typo matching: {e}")
+        trigram_enabled = False
+
+
+def search_tokens(search_query: str) -> List[str]:
+    # Tags are stored uppercase; match the whole query and each word of it
+    normalized = search_query.strip().upper()
+    return list(dict.fromkeys([normalized] + normalized.split()))
+
+
+def search_filter(search_query: str):
+    # Returns (where clause, rank expression) for a user search
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, search_query)
+    tag_match = models.Event.tags.op("&&")(cast(array(search_tokens(search_query)), ARRAY(String)))
+
+    conditions = [models.Event.search_vector.op("@@")(tsquery), tag_match]
+    rank = func.ts_rank(models.Event.search_vector, tsquery) + case((tag_match, 1.0), else_=0.0)
+    if trigram_enabled:
+        conditions.append(literal(search_query).op("<%")(models.Event.title))
+        rank = rank + func.word_similarity(search_query, models.Event.title)
+    return or_(*conditions), rank
+
+
+def matched_tags(tags: List[str], search_query: str) -> List[str]:
+    if not tags or not search_query:
+        return []
+    tokens = set(search_tokens(search_query))
+    return [tag for tag in tags if tag in tokens]
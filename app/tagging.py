@@ -0,0 +1,434 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from sqlalchemy import update, select, text, func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import hashlib
+import httpx
+import logging
+import multiprocessing
+import resource
+import time
+from . import models, versions
+from .config import settings
+from .cache import TTLCache
+from .database import SessionLocal, engine
+
+# Event tags are generated off the request path: create_event stores the user's
+# tags with tag_status "pending", and TaggingWorker fills in the NER tags later
+# from a process pool that batches descriptions through nlp.pipe. With
+# TAGGING_SERVICE_URL set, every web worker sends its batches to one shared
+# tagging service (app/tagging_service.py) instead, so the model is held once.
+
+ENTITY_LABELS = ["PERSON", "ORG", "GPE", "EVENT", "NORP", "WORK_OF_ART", "LANGUAGE", "FAC", "PRODUCT", "LOC"]
+
+# Only NER is used; these pipes are never loaded
+EXCLUDED_PIPES = ["tagger", "parser", "attribute_ruler", "lemmatizer"]
+
+TAG_PENDING = "pending"
+TAG_DONE = "done"
+TAG_FAILED = "failed"
+
+nlp = None
+model_load_seconds = None
+rss_before_model_mb = None
+rss_after_model_mb = None
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is the peak, in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_nlp():
+    # Loaded on first use inside the process that tags (a pool process or the tagging
+    # service), never at import time in the web worker
+    global nlp, model_load_seconds, rss_before_model_mb, rss_after_model_mb
+    if nlp is None:
+        import spacy
+        rss_before_model_mb = current_rss_mb()
+        started = time.perf_counter()
+        nlp = spacy.load("en_core_web_sm", exclude=EXCLUDED_PIPES)
+        model_load_seconds = time.perf_counter() - started
+        rss_after_model_mb = current_rss_mb()
+        logging.info(f"Loaded en_core_web_sm ({', '.join(nlp.pipe_names)}) in {model_load_seconds:.2f}s, RSS {rss_before_model_mb:.0f} -> {rss_after_model_mb:.0f} MB")
+    return nlp
+
+
+def model_stats():
+    return {
+        "loaded": nlp is not None,
+        "pipes": list(nlp.pipe_names) if nlp is not None else [],
+        "load_seconds": model_load_seconds,
+        "rss_before_model_mb": rss_before_model_mb,
+        "rss_after_model_mb": rss_after_model_mb,
+        "rss_mb": current_rss_mb(),
+    }
+
+
+def extract_tags(descriptions: List[str]) -> List[List[str]]:
+    tags = []
+    for doc in get_nlp().pipe(descriptions, batch_size=settings.tagging_batch_size):
+        tags.append(list(set(ent.text for ent in doc.ents if ent.label_ in ENTITY_LABELS)))  # Remove duplicates
+    return tags
+
+
+def merge_tags(existing_tags: Optional[List[str]], auto_tags: List[str]) -> List[str]:
+    # All tags are stored uppercase and without duplicates
+    return list(dict.fromkeys([tag.upper() for tag in (existing_tags or []) + auto_tags]))
+
+
+def description_hash(description: str) -> str:
+    # The model and label set are part of the key, so changing either starts a fresh cache
+    key = f"en_core_web_sm|{','.join(EXCLUDED_PIPES)}|{','.join(ENTITY_LABELS)}|{description}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class TagCache:
+    # Memoizes extracted tags by description hash: an in-process LRU+TTL layer in front
+    # of the optional tag_cache table, so repeated descriptions skip the NLP pipeline
+    def __init__(self, maxsize: int = settings.tag_cache_size, ttl: int = settings.tag_cache_ttl_seconds, persistent: bool = settings.tag_cache_persistent):
+        self.memory = TTLCache(maxsize, ttl)
+        self.persistent = persistent
+        self.table_hits = 0
+        self.table_misses = 0
+
+    def get_many(self, db, hashes: List[str]) -> Dict[str, List[str]]:
+        found = {}
+        for description_hash in hashes:
+            tags = self.memory.get(description_hash)
+            if tags is not None:
+                found[description_hash] = tags
+        missing = [description_hash for description_hash in hashes if description_hash not in found]
+        if missing and self.persistent:
+            rows = db.query(models.TagCacheEntry.description_hash, models.TagCacheEntry.tags).filter(
+                models.TagCacheEntry.description_hash.in_(missing)
+            ).all()
+            for description_hash, tags in rows:
+                found[description_hash] = tags
+                self.memory.set(description_hash, tags)
+            self.table_hits += len(rows)
+            self.table_misses += len(missing) - len(rows)
+        return found
+
+    def put_many(self, db, tags_by_hash: Dict[str, List[str]]):
+        for description_hash, tags in tags_by_hash.items():
+            self.memory.set(description_hash, tags)
+        if self.persistent and tags_by_hash:
+            db.execute(
+                insert(models.TagCacheEntry)
+                .values([{"description_hash": description_hash, "tags": tags} for description_hash, tags in tags_by_hash.items()])
+                .on_conflict_do_nothing(index_elements=["description_hash"])
+            )
+            db.commit()
+
+    def stats(self):
+        return {
+            "memory": self.memory.stats(),
+            "persistent": self.persistent,
+            "table_hits": self.table_hits,
+            "table_misses": self.table_misses,
+        }
+
+
+def ensure_tagging_schema(engine: Engine):
+    # create_all only creates missing tables, so existing databases get the column here
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE events ADD COLUMN IF NOT EXISTS tag_status VARCHAR NOT NULL DEFAULT '{TAG_DONE}'"))
+        conn.execute(text("ALTER TABLE events ADD COLUMN IF NOT EXISTS tag_claimed_at TIMESTAMP"))
+
+
+class TaggingWorker:
+    def __init__(self, session_factory=SessionLocal, workers: int = settings.tagging_workers, batch_size: int = settings.tagging_batch_size, batch_window_ms: int = settings.tagging_batch_window_ms, service_url: Optional[str] = settings.tagging_service_url):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.service_url = service_url
+        self.batch_size = batch_size
+        self.batch_window = batch_window_ms / 1000
+        self.loop = None
+        self.queue = None
+        self.task = None
+        self.requeue_task = None
+        self.pool = None
+        self.cache = TagCache()
+        self.events_tagged = 0
+        self.events_failed = 0
+        self.batches = 0
+        self.descriptions_extracted = 0
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+        # Events left pending by a shutdown or crash would otherwise wait for a manual backfill
+        self.requeue_task = asyncio.create_task(self.requeue_pending())
+
+    async def requeue_pending(self, page_size: int = 1000) -> int:
+        # Every worker runs this on start, so pending events are claimed rather than just
+        # read: each one goes to a single worker's queue however many start together
+        total = 0
+        try:
+            while True:
+                event_ids = await self.loop.run_in_executor(None, self._claim_pending, page_size)
+                if not event_ids:
+                    break
+                for event_id in event_ids:
+                    self.queue.put_nowait(event_id)
+                total += len(event_ids)
+        except Exception as e:
+            logging.error(f"Could not re-queue pending events, run `python -m app.tagging` to tag them: {e}")
+        if total:
+            logging.info(f"Re-queued {total} events still pending tags")
+        return total
+
+    def _claim_pending(self, limit: int) -> List[int]:
+        # Unclaimed, or claimed so long ago that the worker holding them must have died.
+        # SKIP LOCKED lets workers starting together split the rows instead of queueing on them.
+        claimable = (
+            select(models.Event.id)
+            .where(
+                models.Event.tag_status == TAG_PENDING,
+                or_(
+                    models.Event.tag_claimed_at.is_(None),
+                    models.Event.tag_claimed_at < func.now() - timedelta(seconds=settings.tagging_claim_seconds)
+                )
+            )
+            .order_by(models.Event.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        db = self.session_factory()
+        try:
+            event_ids = db.execute(
+                update(models.Event)
+                .where(models.Event.id.in_(claimable.scalar_subquery()))
+                .values(tag_claimed_at=func.now())
+                .returning(models.Event.id)
+            ).scalars().all()
+            db.commit()
+            return sorted(event_ids)
+        finally:
+            db.close()
+
+    async def stop(self):
+        if self.task is None:
+            return
+        await self.requeue_task
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def _get_pool(self):
+        # Started with the first batch, so workers that never tag never spawn a model process.
+        # spawn, not fork: the web process has an event loop and DB connections we don't want to copy
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    async def _extract(self, descriptions: List[str]) -> List[List[str]]:
+        if self.service_url:
+            async with httpx.AsyncClient(timeout=60) as client:
+                response = await client.post(f"{self.service_url}/extract", json={"descriptions": descriptions})
+                response.raise_for_status()
+                return response.json()["tags"]
+        return await self.loop.run_in_executor(self._get_pool(), extract_tags, descriptions)
+
+    async def model_stats(self):
+        if self.service_url:
+            async with httpx.AsyncClient(timeout=10) as client:
+                response = await client.get(f"{self.service_url}/stats")
+                return response.json()
+        if self.pool is None:
+            return {"loaded": False, "rss_mb": current_rss_mb()}
+        return await self.loop.run_in_executor(self.pool, model_stats)
+
+    def submit(self, event_id: int):
+        # Safe to call from the sync routes running in the threadpool
+        if self.loop is None:
+            logging.warning(f"Tagging worker is not running, event {event_id} stays pending")
+            return
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event_id)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            event_id = await self.queue.get()
+            if event_id is None:
+                break
+            batch = [event_id]
+            deadline = self.loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event_id = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event_id is None:
+                    stopping = True
+                    break
+                batch.append(event_id)
+            try:
+                await self._tag(list(dict.fromkeys(batch)))
+            except Exception as e:
+                # Keep the worker alive; the events stay pending until re-tagged
+                logging.error(f"Tagging batch {batch} failed: {e}")
+
+    async def _tag(self, event_ids: List[int]):
+        rows = await self.loop.run_in_executor(None, self._load, event_ids)
+        if not rows:
+            return
+        try:
+            hashes = [description_hash(description) for _, description, _ in rows]
+            tags_by_hash = await self.loop.run_in_executor(None, self._cached_tags, hashes)
+            # Only descriptions the cache has never seen go through the model
+            uncached = {key: description for key, (_, description, _) in zip(hashes, rows) if key not in tags_by_hash}
+            if uncached:
+                extracted = dict(zip(uncached.keys(), await self._extract(list(uncached.values()))))
+                self.descriptions_extracted += len(extracted)
+                await self.loop.run_in_executor(None, self._cache_tags, extracted)
+                tags_by_hash.update(extracted)
+            auto_tags = [tags_by_hash[key] for key in hashes]
+            await self.loop.run_in_executor(None, self._store, rows, auto_tags)
+            self.events_tagged += len(rows)
+        except Exception as e:
+            logging.error(f"Failed to tag events {event_ids}: {e}")
+            await self.loop.run_in_executor(None, self._mark_failed, [event_id for event_id, _, _ in rows])
+            self.events_failed += len(rows)
+        self.batches += 1
+
+    def _load(self, event_ids: List[int]):
+        db = self.session_factory()
+        try:
+            return db.query(models.Event.id, models.Event.description, models.Event.tags).filter(models.Event.id.in_(event_ids)).all()
+        finally:
+            db.close()
+
+    def _cached_tags(self, hashes: List[str]):
+        db = self.session_factory()
+        try:
+            return self.cache.get_many(db, hashes)
+        finally:
+            db.close()
+
+    def _cache_tags(self, tags_by_hash: Dict[str, List[str]]):
+        db = self.session_factory()
+        try:
+            self.cache.put_many(db, tags_by_hash)
+        finally:
+            db.close()
+
+    def _store(self, rows, auto_tags: List[List[str]]):
+        db = self.session_factory()
+        try:
+            store_tags(db, rows, auto_tags)
+        finally:
+            db.close()
+
+    def _mark_failed(self, event_ids: List[int]):
+        db = self.session_factory()
+        try:
+            db.execute(update(models.Event).where(models.Event.id.in_(event_ids)).values(tag_status=TAG_FAILED))
+            versions.bump(db, *map(versions.event_key, event_ids))
+            db.commit()
+        finally:
+            db.close()
+
+    def stats(self):
+        return {
+            "mode": "service" if self.service_url else "pool",
+            "pending_events": self.queue.qsize() if self.queue is not None else 0,
+            "events_tagged": self.events_tagged,
+            "events_failed": self.events_failed,
+            "batches": self.batches,
+            "descriptions_extracted": self.descriptions_extracted,
+            "cache": self.cache.stats(),
+        }
+
+
+def store_tags(db, rows, auto_tags: List[List[str]]):
+    # The rows are locked and re-read, so tags a host saved since the batch was loaded
+    # are merged with rather than overwritten. A changed description means the auto
+    # tags are stale; the edit set the event pending again and submitted it.
+    auto_tags_by_id = {event_id: event_auto_tags for (event_id, description, _), event_auto_tags in zip(rows, auto_tags)}
+    tagged_descriptions = {event_id: description for event_id, description, _ in rows}
+    current = db.execute(
+        select(models.Event.id, models.Event.description, models.Event.tags)
+        .where(models.Event.id.in_(list(auto_tags_by_id)))
+        .order_by(models.Event.id)
+        .with_for_update()
+    ).all()
+    stored = []
+    for event_id, description, tags in current:
+        if description != tagged_descriptions[event_id]:
+            continue
+        db.execute(
+            update(models.Event)
+            .where(models.Event.id == event_id)
+            .values(tags=merge_tags(tags, auto_tags_by_id[event_id]), tag_status=TAG_DONE)
+        )
+        stored.append(event_id)
+    if stored:
+        versions.bump(db, *map(versions.event_key, stored))
+    db.commit()
+
+
+def cached_extract_tags(db, cache: TagCache, descriptions: List[str]) -> List[List[str]]:
+    # In-process variant of the worker's cache lookup, for the backfill command
+    hashes = [description_hash(description) for description in descriptions]
+    tags_by_hash = cache.get_many(db, hashes)
+    uncached = {key: description for key, description in zip(hashes, descriptions) if key not in tags_by_hash}
+    if uncached:
+        extracted = dict(zip(uncached.keys(), extract_tags(list(uncached.values()))))
+        cache.put_many(db, extracted)
+        tags_by_hash.update(extracted)
+    return [tags_by_hash[key] for key in hashes]
+
+
+def backfill(retag_all: bool = False, batch_size: int = 256):
+    # Bulk (re-)tagging of existing events, e.g. `python -m app.tagging --all`
+    db = SessionLocal()
+    cache = TagCache()
+    try:
+        query = db.query(models.Event.id, models.Event.description, models.Event.tags).order_by(models.Event.id)
+        if not retag_all:
+            query = query.filter(models.Event.tag_status != TAG_DONE)
+        last_id = 0
+        total = 0
+        while True:
+            rows = query.filter(models.Event.id > last_id).limit(batch_size).all()
+            if not rows:
+                break
+            store_tags(db, rows, cached_extract_tags(db, cache, [description for _, description, _ in rows]))
+            last_id = rows[-1][0]
+            total += len(rows)
+            logging.info(f"Tagged {total} events")
+        return total
+    finally:
+        db.close()
+
+
+tagging_worker = TaggingWorker()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate NER tags for existing events")
+    parser.add_argument("--all", action="store_true", help="re-tag every event, not only pending or failed ones")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    ensure_tagging_schema(engine)
+    print(f"Tagged {backfill(retag_all=args.all)} events")
@@ -0,0 +1,30 @@
+from fastapi import FastAPI
+from pydantic import BaseModel
+from typing import List
+import threading
+from . import tagging
+
+# Shared NER tagging service: one process holds the spaCy model for every web worker.
+#   uvicorn app.tagging_service:app --port 8001
+# and start the web workers with TAGGING_SERVICE_URL=http://localhost:8001
+
+app = FastAPI()
+
+# spaCy pipelines are not safe to run from several threads at once
+nlp_lock = threading.Lock()
+
+
+class ExtractRequest(BaseModel):
+    descriptions: List[str]
+
+
+@app.post("/extract")
+def extract(request: ExtractRequest):
+    with nlp_lock:
+        tags = tagging.extract_tags(request.descriptions)
+    return {"tags": tags}
+
+
+@app.get("/stats")
+def stats():
+    return tagging.model_stats()
@@ -0,0 +1,147 @@
+from typing import Optional
+import base64
+import hashlib
+import hmac
+import json
+import time
+from jose import JWTError, jwt
+from .cache import TTLCache
+from .config import settings
+
+# Access-token encoding backends plus a cache of already-verified tokens.
+#   jose  - python-jose JWTs (default, what existing cookies use)
+#   pyjwt - PyJWT JWTs, same wire format, faster decode; needs `pip install pyjwt`
+#   hmac  - compact "payload.signature" session tokens signed with HMAC-SHA256
+# Switching between jose/pyjwt keeps sessions valid; switching to or from hmac logs everyone out.
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenBackend:
+    name = "base"
+
+    def __init__(self, secret_key: str = settings.secret_key, algorithm: str = settings.algorithm):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+
+    def encode(self, payload: dict) -> str:
+        raise NotImplementedError
+
+    def decode(self, token: str) -> dict:
+        raise NotImplementedError
+
+
+class JoseBackend(TokenBackend):
+    name = "jose"
+
+    def encode(self, payload: dict) -> str:
+        return jwt.encode(payload, self.secret_key, algorithm=self.algorithm)
+
+    def decode(self, token: str) -> dict:
+        try:
+            return jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+        except JWTError as e:
+            raise TokenError(str(e))
+
+
+class PyJWTBackend(TokenBackend):
+    name = "pyjwt"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        try:
+            import jwt as pyjwt
+        except ImportError:
+            raise RuntimeError("TOKEN_BACKEND=pyjwt needs the PyJWT package")
+        if not hasattr(pyjwt, "PyJWTError"):
+            raise RuntimeError("TOKEN_BACKEND=pyjwt needs the PyJWT package, found a different `jwt` module")
+        self.pyjwt = pyjwt
+
+    def encode(self, payload: dict) -> str:
+        return self.pyjwt.encode(payload, self.secret_key, algorithm=self.algorithm)
+
+    def decode(self, token: str) -> dict:
+        try:
+            return self.pyjwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+        except self.pyjwt.PyJWTError as e:
+            raise TokenError(str(e))
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class HMACBackend(TokenBackend):
+    # No header and no algorithm negotiation: one HMAC-SHA256 over the JSON payload
+    name = "hmac"
+
+    def _sign(self, body: str) -> str:
+        return _b64encode(hmac.new(self.secret_key.encode(), body.encode(), hashlib.sha256).digest())
+
+    def encode(self, payload: dict) -> str:
+        body = _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+        return f"{body}.{self._sign(body)}"
+
+    def decode(self, token: str) -> dict:
+        body, _, signature = token.partition(".")
+        if not signature or not hmac.compare_digest(signature, self._sign(body)):
+            raise TokenError("Signature verification failed")
+        try:
+            payload = json.loads(_b64decode(body))
+        except ValueError:
+            raise TokenError("Malformed token")
+        exp = payload.get("exp")
+        if exp is not None and exp <= time.time():
+            raise TokenError("Signature has expired")
+        return payload
+
+
+BACKENDS = {backend.name: backend for backend in (JoseBackend, PyJWTBackend, HMACBackend)}
+
+
+def get_token_backend(name: str = settings.token_backend) -> TokenBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown token backend: {name}")
+    return BACKENDS[name]()
+
+
+class VerifiedTokenCache:
+    # Payloads of tokens whose signature has already been checked, keyed by a digest of the
+    # token so the cookies themselves are not kept in memory. Entries never outlive `exp`.
+    def __init__(self, backend: TokenBackend, maxsize: int = settings.token_cache_size, ttl: int = settings.token_cache_ttl_seconds):
+        self.backend = backend
+        self.cache = TTLCache(maxsize, ttl)
+
+    def decode(self, token: str) -> dict:
+        key = hashlib.sha256(token.encode()).digest()
+        payload = self.cache.get(key)
+        if payload is not None:
+            return payload
+        payload = self.backend.decode(token)
+        ttl = self.ttl_for(payload)
+        if ttl is None or ttl > 0:
+            self.cache.set(key, payload, ttl)
+        return payload
+
+    def ttl_for(self, payload: dict) -> Optional[float]:
+        exp = payload.get("exp")
+        if exp is None:
+            return None
+        return min(self.cache.ttl, exp - time.time())
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats["backend"] = self.backend.name
+        return stats
+
+
+token_cache = VerifiedTokenCache(get_token_backend())
@@ -0,0 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import UploadFile
+from PIL import Image, ImageOps
+from typing import Optional
+import logging
+import os
+import threading
+import time
+import uuid
+from .config import settings
+
+# Pictures are read in chunks with a size cap and written under a temporary name
+# that is only renamed once complete (app.media stores them). Small derivatives are
+# rendered afterwards in a separate pool: {name}_{size}.webp and {name}_{size}.jpg next to the
+# original. Pages use them through the picture() macro in templates/media.html and
+# fall back to the original until they exist.
+
+CHUNK_SIZE = 64 * 1024
+
+# Longest edge in pixels
+THUMBNAIL_SIZES = {
+    "avatar": 192,
+    "card": 640,
+}
+THUMBNAIL_FORMATS = {
+    "webp": "WEBP",
+    "jpg": "JPEG",
+}
+THUMBNAIL_QUALITY = 80
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+
+
+def read_chunks(upload: UploadFile, max_bytes: Optional[int] = None):
+    max_bytes = max_bytes or settings.upload_max_bytes
+    read = 0
+    while chunk := upload.file.read(CHUNK_SIZE):
+        read += len(chunk)
+        if read > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        yield chunk
+
+
+def finalize_upload(staged_path: str, final_path: str):
+    # Atomic on the same filesystem: readers see the old file or the new one, never a partial one
+    os.replace(staged_path, final_path)
+
+
+def discard_upload(staged_path: str):
+    if os.path.exists(staged_path):
+        os.remove(staged_path)
+
+
+def thumbnail_path(path: str, size: str, ext: str) -> str:
+    return f"{os.path.splitext(path)[0]}_{size}.{ext}"
+
+
+def remove_thumbnails(path: str):
+    for size in THUMBNAIL_SIZES:
+        for ext in THUMBNAIL_FORMATS:
+            discard_upload(thumbnail_path(path, size, ext))
+
+
+def remove_upload(path: Optional[str]):
+    if path:
+        discard_upload(path)
+        remove_thumbnails(path)
+
+
+def thumbnail(path: Optional[str], size: str):
+    # Template helper: static-relative paths of the derivatives, or None until they are rendered
+    if not path:
+        return None
+    webp, jpg = thumbnail_path(path, size, "webp"), thumbnail_path(path, size, "jpg")
+    if not (os.path.exists(webp) and os.path.exists(jpg)):
+        return None
+    return {"webp": webp.replace("static/", "", 1), "jpg": jpg.replace("static/", "", 1)}
+
+
+def render_thumbnails(path: str, sizes=tuple(THUMBNAIL_SIZES)):
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    for size in sizes:
+        edge = THUMBNAIL_SIZES[size]
+        resized = image.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        for ext, image_format in THUMBNAIL_FORMATS.items():
+            target = thumbnail_path(path, size, ext)
+            staged = f"{target}.{uuid.uuid4().hex}.part"
+            # JPEG has no alpha channel
+            output = resized.convert("RGB") if image_format == "JPEG" else resized
+            try:
+                output.save(staged, image_format, quality=THUMBNAIL_QUALITY)
+                finalize_upload(staged, target)
+            except BaseException:
+                discard_upload(staged)
+                raise
+
+
+class Thumbnailer:
+    # Pillow releases the GIL while decoding, resizing and encoding, so a few
+    # threads are enough; they are separate from the threadpool the sync routes use.
+    def __init__(self, workers: int = settings.thumbnail_workers):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnail")
+            return self.executor
+
+    def submit(self, path: str, sizes=tuple(THUMBNAIL_SIZES)):
+        with self.lock:
+            self.pending += 1
+        return self._get_executor().submit(self._render, path, sizes)
+
+    def _render(self, path: str, sizes):
+        started = time.perf_counter()
+        try:
+            render_thumbnails(path, sizes)
+        except Exception as e:
+            # Not an image Pillow can read (or it was replaced meanwhile); pages keep the original
+            logging.warning(f"Could not render thumbnails for {path}: {e}")
+            with self.lock:
+                self.failed += 1
+            return
+        finally:
+            with self.lock:
+                self.pending -= 1
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "max_upload_bytes": settings.upload_max_bytes,
+                "sizes": THUMBNAIL_SIZES,
+                "pending": self.pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_render_ms": self.total_seconds / self.completed * 1000 if self.completed else 0.0,
+                "max_render_ms": self.max_seconds * 1000,
+            }
+
+
+thumbnailer = Thumbnailer()
@@ -0,0 +1,74 @@
+from sqlalchemy import inspect
+from typing import Optional
+import asyncio
+import logging
+from . import models
+from .cache import TTLCache
+from .config import settings
+from .pubsub import PubSubBackend, get_pubsub_backend
+
+# Column values of authenticated users by id, so get_current_user can skip the users
+# query on every request. The password hash is never cached.
+CACHED_COLUMNS = [column.key for column in inspect(models.User).column_attrs if column.key != "password"]
+
+# All workers listen on one channel; the payload is the user id to drop
+INVALIDATION_CHANNEL = 0
+
+
+class UserCache:
+    def __init__(self, backend: PubSubBackend, maxsize: int = settings.user_cache_size, ttl: int = settings.user_cache_ttl_seconds):
+        self.cache = TTLCache(maxsize, ttl)
+        self.backend = backend
+        self.loop = None
+        self.invalidations = 0
+        self.invalidations_received = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await self.backend.subscribe(INVALIDATION_CHANNEL, self._on_invalidate)
+
+    async def stop(self):
+        await self.backend.unsubscribe(INVALIDATION_CHANNEL)
+        await self.backend.close()
+        self.loop = None
+
+    def get(self, user_id: int) -> Optional[models.User]:
+        values = self.cache.get(user_id)
+        if values is None:
+            return None
+        # A fresh transient instance per request, so no ORM state is shared between threads
+        return models.User(**values)
+
+    def set(self, user: models.User):
+        self.cache.set(user.id, {key: getattr(user, key) for key in CACHED_COLUMNS})
+
+    def invalidate(self, user_id: int):
+        # Call after every commit that changes a users row
+        self.cache.pop(user_id)
+        self.invalidations += 1
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.backend.publish(INVALIDATION_CHANNEL, str(user_id)), self.loop)
+
+    def _on_invalidate(self, _, payload: str):
+        try:
+            self.cache.pop(int(payload))
+        except ValueError:
+            logging.error(f"Ignoring malformed user cache invalidation: {payload}")
+            return
+        self.invalidations_received += 1
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats.update({
+            "backend": self.backend.name,
+            "db_queries_saved": self.cache.hits,
+            "invalidations": self.invalidations,
+            "invalidations_received": self.invalidations_received,
+        })
+        return stats
+
+
+user_cache = UserCache(get_pubsub_backend(settings.user_cache_invalidation_backend, channel_prefix="user_cache_"))
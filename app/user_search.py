@@ -0,0 +1,52 @@
+from sqlalchemy import func, or_, case, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from typing import List
+import logging
+from . import models
+
+# Typeahead over users.email: prefix matches use the lower(email) text_pattern_ops
+# index; with pg_trgm, queries of 3+ characters also match anywhere in the address.
+
+MIN_TRIGRAM_QUERY_LENGTH = 3
+
+trigram_enabled = False
+
+
+def ensure_user_search_schema(engine: Engine):
+    global trigram_enabled
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_email_lower_prefix ON users (lower(email) text_pattern_ops)"))
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_email_trgm ON users USING gin (lower(email) gin_trgm_ops)"))
+        trigram_enabled = True
+    except Exception as e:
+        logging.warning(f"pg_trgm is unavailable, user search only matches email prefixes: {e}")
+        trigram_enabled = False
+
+
+def email_prefix_match(search_query: str):
+    return func.lower(models.User.email).startswith(search_query.strip().lower(), autoescape=True)
+
+
+def email_filter(search_query: str):
+    normalized = search_query.strip().lower()
+    prefix = email_prefix_match(normalized)
+    if trigram_enabled and len(normalized) >= MIN_TRIGRAM_QUERY_LENGTH:
+        return or_(prefix, func.lower(models.User.email).contains(normalized, autoescape=True))
+    return prefix
+
+
+def search_users(db: Session, search_query: str, exclude_emails: List[str], exclude_user_id: int, limit: int, *conditions):
+    # Prefix matches rank above matches in the middle of the address
+    query = select(models.User.id, models.User.email).where(
+        email_filter(search_query),
+        models.User.id != exclude_user_id,
+        *conditions
+    )
+    if exclude_emails:
+        query = query.where(models.User.email.notin_(exclude_emails))
+    query = query.order_by(case((email_prefix_match(search_query), 0), else_=1), models.User.email)
+    return db.execute(query.limit(limit)).all()
@@ -1,9 +1,29 @@
 from passlib.context import CryptContext
+from datetime import datetime
+from .config import settings
+import base64
 
-pwd_context = CryptContext(schemes = ["bcrypt"], deprecated = "auto")
+# Raising BCRYPT_ROUNDS upgrades existing hashes on the next successful login
+pwd_context = CryptContext(schemes = ["bcrypt"], deprecated = "auto", bcrypt__rounds = settings.bcrypt_rounds)
 
 def hash(password : str):
     return pwd_context.hash(password)
 
 def verify(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+def verify_and_update(plain_password, hashed_password):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+# Opaque keyset cursors over (timestamp, id) pairs
+def encode_cursor(timestamp : datetime, id : int):
+    raw = f"{timestamp.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor : str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
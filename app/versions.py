@@ -0,0 +1,86 @@
+from fastapi import Request, Response, status
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import Dict
+import hashlib
+from . import models
+
+# Version stamps for conditional GETs and cached fragments. "event:{id}" changes
+# with anything an event's card or page shows; "feed:public" and "feed:invited"
+# change when events enter or leave those feeds, which is all the feed badge counts
+# depend on. Bumps are staged in the write's own transaction, just before its commit,
+# so a version never moves without the data or the other way round. Keys are scoped,
+# so a join only locks its own event's row, and only for the length of that commit.
+
+PUBLIC_FEED = "feed:public"
+INVITED_FEED = "feed:invited"
+
+# Browsers keep the page but revalidate it on every request
+REVALIDATE = "private, no-cache"
+
+
+def event_key(event_id: int) -> str:
+    return f"event:{event_id}"
+
+
+def feed_key(public: bool) -> str:
+    return PUBLIC_FEED if public else INVITED_FEED
+
+
+def bump_statement(*keys: str):
+    # Sorted so concurrent writers lock the rows in the same order
+    return (
+        pg_insert(models.ContentVersion)
+        .values([{"key": key, "version": 1} for key in sorted(set(keys))])
+        .on_conflict_do_update(
+            index_elements=[models.ContentVersion.key],
+            set_={"version": models.ContentVersion.version + 1}
+        )
+    )
+
+
+def bump(db: Session, *keys: str):
+    # Call last before the write's commit; the caller commits
+    db.execute(bump_statement(*keys))
+
+
+async def bump_async(db: AsyncSession, *keys: str):
+    await db.execute(bump_statement(*keys))
+
+
+async def read_versions(db: AsyncSession, *keys: str) -> Dict[str, int]:
+    if not keys:
+        return {}
+    rows = await db.execute(
+        select(models.ContentVersion.key, models.ContentVersion.version).where(models.ContentVersion.key.in_(keys))
+    )
+    versions = dict(rows.all())
+    return {key: versions.get(key, 0) for key in keys}
+
+
+def make_etag(*parts) -> str:
+    # Weak, since the compression middleware may re-encode the body
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": REVALIDATE})
+
+
+def set_validators(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE
+    return response
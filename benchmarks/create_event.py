@@ -0,0 +1,80 @@
+"""Latency and commits per POST /events/create_event.
+
+    python -m benchmarks.create_event
+
+Creates private events with a picture and two invitees through the app against
+the configured database (app.config), counts the session commits each request
+makes, then deletes everything it created. Pictures are written to a temporary
+directory, not static/.
+"""
+from datetime import date, datetime, timedelta
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, event as sa_event
+from sqlalchemy.orm import Session
+import logging
+import os
+import statistics
+import tempfile
+import time
+from app.main import app
+from app.database import SessionLocal
+from app.models import User
+from app.oauth2 import create_access_token
+
+CREATES = 50
+
+
+def main():
+    db = SessionLocal()
+    db.execute(delete(User).where(User.email.like("bench-create-%")))
+    users = [User(email=f"bench-create-{i}@example.com", password="x", birthday=date(2000, 1, 1)) for i in range(3)]
+    db.add_all(users)
+    db.commit()
+
+    commits = 0
+
+    def count_commit(session):
+        nonlocal commits
+        commits += 1
+
+    sa_event.listen(Session, "after_commit", count_commit)
+    client = TestClient(app)
+    client.cookies.set("access_token", create_access_token(data={"user_id": users[0].id}))
+    form = {
+        "title": "Benchmark event",
+        "description": "Benchmark event",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Nowhere",
+        "public": "false",
+        "invitees": [u.email for u in users[1:]],
+    }
+    timings = []
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            for _ in range(CREATES):
+                started = time.perf_counter()
+                response = client.post("/events/create_event", data=form,
+                                       files={"picture": ("pic.jpg", b"x" * 50_000, "image/jpeg")},
+                                       follow_redirects=False)
+                timings.append(time.perf_counter() - started)
+                assert response.status_code == 303, response.text
+    finally:
+        os.chdir(cwd)
+        sa_event.remove(Session, "after_commit", count_commit)
+        # Events, attendance and invitations cascade with their host
+        db.execute(delete(User).where(User.email.like("bench-create-%")))
+        db.commit()
+        db.close()
+
+    print(f"creates:            {CREATES}")
+    print(f"commits per create: {commits / CREATES:.1f}")
+    print(f"median latency:     {statistics.median(timings) * 1000:.2f} ms")
+    print(f"p95 latency:        {statistics.quantiles(timings, n=20)[-1] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    # The tagging worker is not started here; its "stays pending" warning is expected
+    logging.disable(logging.WARNING)
+    main()
@@ -0,0 +1,51 @@
+"""Startup time and RSS of a process with and without the spaCy model.
+
+    python -m benchmarks.tagging_model
+
+Each scenario runs in a fresh interpreter so the numbers don't leak into each
+other. Needs the same environment variables as the app (app.config).
+"""
+import json
+import subprocess
+import sys
+
+SCENARIOS = {
+    # What a web worker pays now: the events router no longer touches spaCy at import
+    "web worker import (no model)": """
+import time
+started = time.perf_counter()
+import app.routers.event
+elapsed = time.perf_counter() - started
+""",
+    "full en_core_web_sm pipeline": """
+import time
+import spacy
+started = time.perf_counter()
+nlp = spacy.load("en_core_web_sm")
+elapsed = time.perf_counter() - started
+""",
+    "NER-only pipeline (app.tagging)": """
+import time
+from app import tagging
+started = time.perf_counter()
+tagging.get_nlp()
+elapsed = time.perf_counter() - started
+""",
+}
+
+REPORT = """
+from app.tagging import current_rss_mb
+import json
+print(json.dumps({"seconds": elapsed, "rss_mb": current_rss_mb()}))
+"""
+
+
+def run(code):
+    output = subprocess.run([sys.executable, "-c", code + REPORT], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    for name, code in SCENARIOS.items():
+        result = run(code)
+        print(f"{name:35} {result['seconds']:8.2f}s {result['rss_mb']:10.1f} MB RSS")
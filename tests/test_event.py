@@ -1,9 +1,29 @@
 import pytest
+import time
+import io
+import os
 from fastapi.testclient import TestClient
-from app.models import Event, Attend, User
+from app.models import Event, Attend, User, Message, Invitation, EventSummary
 from app.schemas import EventCreate
 from app.oauth2 import create_access_token
 from datetime import datetime, timedelta
+from bs4 import BeautifulSoup
+from sqlalchemy import func, text
+from app.config import settings
+from app import uploads, media, versions
+from app.live import feed_updates
+from app.tagging import tagging_worker, store_tags
+from app.main import app
+from PIL import Image
+
+def wait_for_tags(client: TestClient, event_id: int) -> dict:
+    # Tagging runs in the background worker; poll until it leaves "pending"
+    for _ in range(300):
+        data = client.get(f"/events/{event_id}/tags").json()
+        if data["tag_status"] != "pending":
+            break
+        time.sleep(0.1)
+    return data
 
 # Test for GET /events/partial
 def test_get_events_partial(client: TestClient, create_test_user):
@@ -86,3 +106,781 @@ def test_delete_event(client: TestClient, create_test_user, db):
     assert response.status_code == 303
     assert response.headers["location"] == f"/{user.id}/profile"
 
+
+# Test that a failed delete keeps the event, its messages and its picture
+def test_delete_event_single_transaction(client: TestClient, create_test_user, db, tmp_path, monkeypatch):
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+
+    # A picture from before the media store, which release removes directly
+    picture = tmp_path / "legacy.jpg"
+    picture.write_bytes(b"picture")
+    test_event = Event(
+        title="Test Event",
+        description="This is a test event",
+        event_time=datetime.utcnow() + timedelta(days=1),
+        location="Test Location",
+        host_id=user.id,
+        public=False,
+        picture=str(picture)
+    )
+    db.add(test_event)
+    db.commit()
+    db.add(Message(content="hello", user_id=user.id, event_id=test_event.id, timestamp=datetime.utcnow()))
+    db.add(Invitation(event_id=test_event.id, user_id=user.id))
+    db.commit()
+
+    def failing_bump(*args):
+        raise RuntimeError("bump failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(versions, "bump", failing_bump)
+        with pytest.raises(RuntimeError):
+            client.delete(f"/events/delete/{test_event.id}", allow_redirects=False)
+    db.expire_all()
+    assert db.query(Event).filter(Event.id == test_event.id).count() == 1
+    assert db.query(Message).filter(Message.event_id == test_event.id).count() == 1
+    assert db.query(Invitation).filter(Invitation.event_id == test_event.id).count() == 1
+    assert picture.exists()
+
+    response = client.delete(f"/events/delete/{test_event.id}", allow_redirects=False)
+    assert response.status_code == 303
+    assert db.query(Event).filter(Event.id == test_event.id).count() == 0
+    assert db.query(Message).filter(Message.event_id == test_event.id).count() == 0
+    assert not picture.exists()
+
+# Test for GET /events/{event_id}/messages keyset pagination
+def test_get_event_messages_pagination(client: TestClient, create_test_user, db):
+    user = create_test_user("testuser@example.com", "password123")
+    token = create_access_token(data={"user_id": user.id})
+    client.cookies.set("access_token", token)
+
+    test_event = Event(
+        title="Test Event",
+        description="This is a test event",
+        event_time=datetime.utcnow() + timedelta(days=1),
+        location="Test Location",
+        host_id=user.id,
+        public=True
+    )
+    db.add(test_event)
+    db.commit()
+    db.refresh(test_event)
+
+    start = datetime.utcnow()
+    for i in range(5):
+        db.add(Message(content=f"message {i}", user_id=user.id, event_id=test_event.id, timestamp=start + timedelta(seconds=i)))
+    db.commit()
+
+    response = client.get(f"/events/{test_event.id}/messages", params={"limit": 2})
+    assert response.status_code == 200
+    data = response.json()
+    assert [m["content"] for m in data["messages"]] == ["message 3", "message 4"]
+    assert data["has_more"] is True
+
+    response = client.get(f"/events/{test_event.id}/messages", params={"limit": 2, "before": data["prev_cursor"]})
+    older = response.json()
+    assert [m["content"] for m in older["messages"]] == ["message 1", "message 2"]
+
+    response = client.get(f"/events/{test_event.id}/messages", params={"since_id": older["messages"][-1]["id"]})
+    missed = response.json()
+    assert [m["content"] for m in missed["messages"]] == ["message 3", "message 4"]
+    assert missed["has_more"] is False
+
+# Test that the events feed reads participant counts from the event summary
+def test_events_partial_participant_count(client: TestClient, create_test_user):
+    host = create_test_user("host@example.com", "password123")
+    guest = create_test_user("guest@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+
+    event_data = {
+        "title": "Summary Event",
+        "description": "This is a test event",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Test Location",
+        "public": True
+    }
+    response = client.post("/events/create_event", data=event_data, follow_redirects=False)
+    assert response.status_code == 303
+
+    response = client.get("/events/partial")
+    assert "Summary Event" in response.text
+    assert "Number of Participants: 1" in BeautifulSoup(response.text, "html.parser").get_text()
+
+    client.cookies.set("access_token", create_access_token(data={"user_id": guest.id}))
+    event_id = BeautifulSoup(response.text, "html.parser").find("input", {"name": "event_id"})["value"]
+    client.post("/attend/", data={"event_id": event_id})
+
+    response = client.get("/events/partial")
+    assert "Number of Participants: 2" in BeautifulSoup(response.text, "html.parser").get_text()
+    assert "Leave" in response.text
+
+# Test for GET /events/partial/more keyset pagination
+def test_events_partial_load_more(client: TestClient, create_test_user, monkeypatch):
+    monkeypatch.setattr(settings, "events_page_size", 2)
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+
+    for i in range(3):
+        event_data = {
+            "title": f"Paged Event {i}",
+            "description": "This is a test event",
+            "event_time": (datetime.utcnow() + timedelta(days=i + 1)).isoformat(),
+            "location": "Test Location",
+            "public": True
+        }
+        client.post("/events/create_event", data=event_data, follow_redirects=False)
+
+    response = client.get("/events/partial")
+    events_list = BeautifulSoup(response.text, "html.parser").find("div", {"id": "events-list"})
+    assert "Paged Event 0" in events_list.text
+    assert "Paged Event 1" in events_list.text
+    assert "Paged Event 2" not in events_list.text
+
+    load_more = events_list.find("div", {"hx-trigger": "revealed"})
+    response = client.get(load_more["hx-get"])
+    assert response.status_code == 200
+    assert "Paged Event 2" in response.text
+    assert "Paged Event 1" not in response.text
+    assert 'hx-trigger="revealed"' not in response.text
+
+# Test for GET /events/search
+def test_search_events(client: TestClient, create_test_user, db):
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+
+    for title, description, tags in [
+        ("Jazz Night", "Live music downtown", ["MUSIC"]),
+        ("Chess Club", "Weekly chess games", ["TORONTO"]),
+    ]:
+        db.add(Event(
+            title=title,
+            description=description,
+            event_time=datetime.utcnow() + timedelta(days=1),
+            location="Test Location",
+            host_id=user.id,
+            public=True,
+            tags=tags
+        ))
+    db.commit()
+
+    response = client.get("/events/search", params={"q": "music"})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["title"] for r in results] == ["Jazz Night"]
+    assert results[0]["matched_tags"] == ["MUSIC"]
+
+    response = client.get("/events/search", params={"q": "toronto"})
+    results = response.json()["results"]
+    assert [r["title"] for r in results] == ["Chess Club"]
+    assert results[0]["matched_tags"] == ["TORONTO"]
+
+# Test that tags are generated in the background after POST /events/create_event
+def test_create_event_tags_in_background(client: TestClient, create_test_user, db):
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+
+    event_data = {
+        "title": "Tagged Event",
+        "description": "A meetup in Toronto",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Test Location",
+        "tags": "games, fun",
+        "public": True
+    }
+    response = client.post("/events/create_event", data=event_data, follow_redirects=False)
+    assert response.status_code == 303
+
+    event = db.query(Event).filter(Event.title == "Tagged Event").first()
+    data = wait_for_tags(client, event.id)
+    assert data["tag_status"] == "done"
+    assert {"GAMES", "FUN"} <= set(data["tags"])
+
+# Test that an event with an already-seen description reuses the cached tags
+def test_tag_cache_reuses_description(client: TestClient, create_test_user, db):
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+
+    def create_and_wait(title):
+        event_data = {
+            "title": title,
+            "description": "Board games night in Vancouver",
+            "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+            "location": "Test Location",
+            "tags": "",
+            "public": True
+        }
+        client.post("/events/create_event", data=event_data, follow_redirects=False)
+        event = db.query(Event).filter(Event.title == title).first()
+        data = wait_for_tags(client, event.id)
+        assert data["tag_status"] == "done"
+        return data["tags"]
+
+    first_tags = create_and_wait("First Night")
+    extracted = client.get("/tagging/stats").json()["descriptions_extracted"]
+    assert create_and_wait("Second Night") == first_tags
+    stats = client.get("/tagging/stats").json()
+    assert stats["descriptions_extracted"] == extracted
+    assert stats["cache"]["memory"]["hits"] >= 1
+
+# Test that events left pending by a restart are claimed by one worker when it starts
+def test_tagging_requeues_pending_events(client: TestClient, create_test_user, db):
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+    events = {}
+    # Never claimed, claimed by a worker that is still running, claimed by one that died
+    for title, claimed_at in [
+        ("Left Pending", None),
+        ("Being Tagged", func.now()),
+        ("Abandoned", func.now() - timedelta(seconds=settings.tagging_claim_seconds + 60)),
+    ]:
+        events[title] = Event(
+            title=title,
+            description="A concert in Paris with the Berlin Philharmonic",
+            event_time=datetime.utcnow() + timedelta(days=1),
+            location="Test Location",
+            host_id=user.id,
+            public=True,
+            tag_status="pending",
+            tag_claimed_at=claimed_at
+        )
+        db.add(events[title])
+    db.commit()
+
+    assert client.portal.call(tagging_worker.requeue_pending) == 2
+    # Another worker starting now finds nothing left to claim
+    assert client.portal.call(tagging_worker.requeue_pending) == 0
+    assert wait_for_tags(client, events["Left Pending"].id)["tag_status"] == "done"
+    assert wait_for_tags(client, events["Abandoned"].id)["tag_status"] == "done"
+    db.refresh(events["Being Tagged"])
+    assert events["Being Tagged"].tag_status == "pending"
+
+# Test that storing auto tags keeps a concurrent host edit
+def test_store_tags_keeps_concurrent_edits(create_test_user, db):
+    user = create_test_user("testuser@example.com", "password123")
+    events = [
+        Event(
+            title=title,
+            description="A concert in Paris",
+            event_time=datetime.utcnow() + timedelta(days=1),
+            location="Test Location",
+            host_id=user.id,
+            public=True,
+            tags=["MUSIC"],
+            tag_status="pending"
+        )
+        for title in ("Retagged", "Rewritten")
+    ]
+    db.add_all(events)
+    db.commit()
+    # What the worker loaded before the host saved their edits
+    rows = [(event.id, event.description, event.tags) for event in events]
+
+    db.query(Event).filter(Event.id == events[0].id).update({"tags": ["MUSIC", "OUTDOORS"]})
+    db.query(Event).filter(Event.id == events[1].id).update({"description": "A play in Rome"})
+    db.commit()
+    store_tags(db, rows, [["PARIS"], ["PARIS"]])
+
+    db.refresh(events[0])
+    db.refresh(events[1])
+    assert events[0].tags == ["MUSIC", "OUTDOORS", "PARIS"]
+    assert events[0].tag_status == "done"
+    # Tags of the old description are dropped; the edit queues a new run
+    assert events[1].tags == ["MUSIC"]
+    assert events[1].tag_status == "pending"
+
+# Test the chat WebSocket end to end: cookie auth, broadcast and the persisted history
+def test_chat_websocket(client: TestClient, create_test_user, db):
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+
+    test_event = Event(
+        title="Chat Event",
+        description="This is a test event",
+        event_time=datetime.utcnow() + timedelta(days=1),
+        location="Test Location",
+        host_id=user.id,
+        public=True
+    )
+    db.add(test_event)
+    db.commit()
+    db.refresh(test_event)
+
+    with client.websocket_connect(f"/ws/{test_event.id}") as websocket:
+        websocket.send_text('{"content": "hello"}')
+        data = websocket.receive_json()
+    assert data["content"] == "hello"
+    assert data["email"] == "testuser@example.com"
+
+    for _ in range(50):
+        messages = client.get(f"/events/{test_event.id}/messages").json()["messages"]
+        if messages:
+            break
+        time.sleep(0.1)
+    assert [m["content"] for m in messages] == ["hello"]
+    # The live frame carries the id the row was stored under
+    assert messages[0]["id"] == data["id"]
+    assert client.get(f"/events/{test_event.id}/messages", params={"since_id": data["id"]}).json()["messages"] == []
+
+# Test GET /events/{id}/invitable: only hosts, skips invited users, searches and pages by email
+def test_get_invitable_users(client: TestClient, create_test_user, db, monkeypatch):
+    host = create_test_user("host@example.com", "password123")
+    invited = create_test_user("invited@example.com", "password123")
+    for name in ["anna", "bob", "carl"]:
+        create_test_user(f"{name}@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+
+    test_event = Event(
+        title="Private Event",
+        description="This is a test event",
+        event_time=datetime.utcnow() + timedelta(days=1),
+        location="Test Location",
+        host_id=host.id,
+        public=False
+    )
+    db.add(test_event)
+    db.commit()
+    db.refresh(test_event)
+    db.add(Invitation(event_id=test_event.id, user_id=invited.id))
+    db.commit()
+
+    def emails(response):
+        soup = BeautifulSoup(response.content, "html.parser")
+        return [checkbox["value"] for checkbox in soup.find_all("input", {"name": "new_invitees"})]
+
+    monkeypatch.setattr(settings, "invitable_users_page_size", 2)
+    response = client.get(f"/events/{test_event.id}/invitable")
+    assert response.status_code == 200
+    assert emails(response) == ["anna@example.com", "bob@example.com"]
+    more = BeautifulSoup(response.content, "html.parser").find("div", {"hx-trigger": "revealed"})["hx-get"]
+    assert emails(client.get(more)) == ["carl@example.com"]
+
+    assert emails(client.get(f"/events/{test_event.id}/invitable", params={"q": "BO"})) == ["bob@example.com"]
+
+    client.cookies.set("access_token", create_access_token(data={"user_id": invited.id}))
+    assert client.get(f"/events/{test_event.id}/invitable").status_code == 403
+
+# Test bulk invitations and attendance import: one pass, duplicates skipped, unknown emails reported
+def test_bulk_invitations_and_attendance_import(client: TestClient, create_test_user, db):
+    host = create_test_user("host@example.com", "password123")
+    anna = create_test_user("anna@example.com", "password123")
+    bob = create_test_user("bob@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+
+    event_data = {
+        "title": "Private Event",
+        "description": "This is a test event",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Test Location",
+        "public": False,
+        "invitees": ["anna@example.com", "nobody@example.com"]
+    }
+    assert client.post("/events/create_event", data=event_data, follow_redirects=False).status_code == 303
+    event = db.query(Event).filter(Event.title == "Private Event").first()
+
+    response = client.post(f"/events/{event.id}/invitations", json={"emails": ["anna@example.com", "bob@example.com", "ghost@example.com", "bob@example.com"]})
+    assert response.status_code == 200
+    assert response.json() == {"added": ["bob@example.com"], "already_present": ["anna@example.com"], "unknown": ["ghost@example.com"]}
+    assert db.query(Invitation).filter(Invitation.event_id == event.id).count() == 3
+
+    response = client.post(f"/events/{event.id}/attendees/import", json={"emails": ["host@example.com", "anna@example.com", "ghost@example.com"]})
+    assert response.json() == {"added": ["anna@example.com"], "already_present": ["host@example.com"], "unknown": ["ghost@example.com"]}
+    summary = db.query(EventSummary).filter(EventSummary.event_id == event.id).one()
+    db.refresh(summary)
+    assert summary.participant_count == 2
+    assert sorted(summary.participant_ids) == sorted([host.id, anna.id])
+    assert sorted(summary.invited_user_ids) == sorted([host.id, anna.id, bob.id])
+
+    client.cookies.set("access_token", create_access_token(data={"user_id": bob.id}))
+    assert client.post(f"/events/{event.id}/invitations", json={"emails": ["anna@example.com"]}).status_code == 403
+
+# Test that an update commits its new invitees with it and announces the event to them
+def test_update_event_invites_in_one_transaction(client: TestClient, create_test_user, db, monkeypatch):
+    host = create_test_user("host@example.com", "password123")
+    anna = create_test_user("anna@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+
+    event_data = {
+        "title": "Private Event",
+        "description": "This is a test event",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Test Location",
+        "public": False
+    }
+    client.post("/events/create_event", data=event_data, follow_redirects=False)
+    event = db.query(Event).filter(Event.title == "Private Event").one()
+    update_data = {**event_data, "title": "Renamed Event", "current_picture": "static/images/event.jpg", "new_invitees": ["anna@example.com"]}
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("invitations unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr("app.routers.event.invitations.invite_emails", fail)
+        with pytest.raises(RuntimeError):
+            client.post(f"/events/update/{event.id}", data=update_data)
+    db.refresh(event)
+    assert event.title == "Private Event"
+
+    anna_feed = feed_updates.subscribe(anna.id)
+    try:
+        assert client.post(f"/events/update/{event.id}", data=update_data).status_code == 200
+        db.refresh(event)
+        assert event.title == "Renamed Event"
+        assert db.query(Invitation).filter(Invitation.event_id == event.id, Invitation.user_id == anna.id).count() == 1
+        for _ in range(50):
+            if not anna_feed.empty():
+                break
+            time.sleep(0.05)
+        assert anna_feed.get_nowait() == {"type": "new_event", "event_id": event.id, "public": False, "user_ids": [anna.id]}
+    finally:
+        feed_updates.unsubscribe(anna_feed)
+
+# Test that create_event is atomic: a failed request leaves no rows and no partial files
+def test_create_event_single_transaction(client: TestClient, create_test_user, db, tmp_path, monkeypatch):
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+    monkeypatch.chdir(tmp_path)
+
+    event_data = {
+        "title": "Picture Event",
+        "description": "This is a test event",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Test Location",
+        "public": False
+    }
+    files = {"picture": ("party.jpg", b"jpeg bytes", "image/jpeg")}
+    response = client.post("/events/create_event", data=event_data, files=files, follow_redirects=False)
+    assert response.status_code == 303
+
+    event = db.query(Event).filter(Event.title == "Picture Event").one()
+    assert event.picture.startswith("static/media/")
+    assert (tmp_path / event.picture).read_bytes() == b"jpeg bytes"
+    assert db.query(Attend).filter(Attend.event_id == event.id).count() == 1
+    assert db.query(Invitation).filter(Invitation.event_id == event.id).count() == 1
+
+    # A failure anywhere in the pipeline leaves neither rows nor files behind
+    def fail(*args, **kwargs):
+        raise RuntimeError("invitations unavailable")
+    monkeypatch.setattr("app.routers.event.invitations.invite_emails", fail)
+    stored = sorted(path for path in tmp_path.rglob("*") if path.is_file())
+    broken_files = {"picture": ("broken.jpg", b"bytes no stored picture has", "image/jpeg")}
+    with pytest.raises(RuntimeError):
+        client.post("/events/create_event", data={**event_data, "title": "Broken Event"}, files=broken_files, follow_redirects=False)
+    assert db.query(Event).filter(Event.title == "Broken Event").count() == 0
+    assert sorted(path for path in tmp_path.rglob("*") if path.is_file()) == stored
+
+# Test join/leave: idempotent, and each response carries the new participant count
+def test_join_and_leave_event(client: TestClient, create_test_user, db):
+    host = create_test_user("host@example.com", "password123")
+    guest = create_test_user("guest@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+    event_data = {
+        "title": "Join Event",
+        "description": "This is a test event",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Test Location",
+        "public": True
+    }
+    client.post("/events/create_event", data=event_data, follow_redirects=False)
+    event = db.query(Event).filter(Event.title == "Join Event").one()
+
+    client.cookies.set("access_token", create_access_token(data={"user_id": guest.id}))
+    for _ in range(2):
+        response = client.post(f"/attend/{event.id}/join")
+        assert response.status_code == 200
+        soup = BeautifulSoup(response.text, "html.parser")
+        assert soup.find(id=f"participants-{event.id}").text == "2"
+        assert soup.find("form")["hx-post"] == f"/attend/{event.id}/leave"
+    summary = db.query(EventSummary).filter(EventSummary.event_id == event.id).one()
+    db.refresh(summary)
+    assert summary.participant_count == 2
+    assert sorted(summary.participant_ids) == sorted([host.id, guest.id])
+
+    for _ in range(2):
+        response = client.post(f"/attend/{event.id}/leave")
+        assert BeautifulSoup(response.text, "html.parser").find(id=f"participants-{event.id}").text == "1"
+    db.refresh(summary)
+    assert summary.participant_ids == [host.id]
+    assert db.query(Attend).filter(Attend.event_id == event.id).count() == 1
+
+    assert client.post("/attend/999999/join").status_code == 404
+
+# Test that uploads are capped and event pictures get WebP/JPEG thumbnails for the feed
+def test_event_picture_thumbnails(client: TestClient, create_test_user, db, tmp_path, monkeypatch):
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+    (tmp_path / "templates").symlink_to(os.path.abspath("templates"))
+    monkeypatch.chdir(tmp_path)
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (1600, 1200), "purple").save(buffer, "PNG")
+    event_data = {
+        "title": "Thumbnail Event",
+        "description": "This is a test event",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Test Location",
+        "public": True
+    }
+
+    monkeypatch.setattr(settings, "upload_max_bytes", 1024)
+    response = client.post("/events/create_event", data=event_data, files={"picture": ("big.png", buffer.getvalue(), "image/png")}, follow_redirects=False)
+    assert response.status_code == 413
+    assert db.query(Event).count() == 0
+    assert [p for p in tmp_path.rglob("*") if p.is_file()] == []
+
+    monkeypatch.setattr(settings, "upload_max_bytes", 10 * 1024 * 1024)
+    response = client.post("/events/create_event", data=event_data, files={"picture": ("big.png", buffer.getvalue(), "image/png")}, follow_redirects=False)
+    assert response.status_code == 303
+    event = db.query(Event).filter(Event.title == "Thumbnail Event").one()
+
+    for _ in range(50):
+        if uploads.thumbnail(event.picture, "card"):
+            break
+        time.sleep(0.1)
+    thumb_path = uploads.thumbnail(event.picture, "card")["webp"]
+    with Image.open(tmp_path / "static" / thumb_path) as thumb:
+        assert max(thumb.size) == uploads.THUMBNAIL_SIZES["card"]
+
+    response = client.get("/events/partial")
+    soup = BeautifulSoup(response.text, "html.parser")
+    assert soup.find("source", {"type": "image/webp"})["srcset"].endswith(f"/static/{thumb_path}")
+
+# Test the content-addressed media store: deduplication, immutable caching and garbage collection
+def test_media_store_dedup_caching_and_gc(client: TestClient, create_test_user, db, tmp_path, monkeypatch):
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+    monkeypatch.chdir(tmp_path)
+    media_mount = next(route for route in app.routes if getattr(route, "name", None) == "media")
+    monkeypatch.setattr(media_mount.app, "all_directories", [str(tmp_path / "static" / "media")])
+
+    event_data = {
+        "description": "This is a test event",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Test Location",
+        "public": True
+    }
+    files = {"picture": ("party.JPG", b"same picture", "image/jpeg")}
+    for title in ("First", "Second"):
+        client.post("/events/create_event", data={**event_data, "title": title}, files=files, follow_redirects=False)
+    first, second = [db.query(Event).filter(Event.title == title).one() for title in ("First", "Second")]
+    assert first.picture == second.picture
+    assert first.picture.endswith(".jpg")
+    assert len([p for p in (tmp_path / "static" / "media").rglob("*.jpg")]) == 1
+
+    response = client.get("/" + first.picture)
+    assert response.content == b"same picture"
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    assert etag.strip('"') in first.picture
+    assert client.get("/" + first.picture, headers={"If-None-Match": etag}).status_code == 304
+
+    # The blob is kept while any event still points at it
+    client.delete(f"/events/delete/{first.id}", follow_redirects=False)
+    assert media.collect_garbage(db, grace_seconds=0)["files_removed"] == 0
+    client.delete(f"/events/delete/{second.id}", follow_redirects=False)
+    assert media.collect_garbage(db, grace_seconds=0)["files_removed"] >= 1
+    assert not (tmp_path / first.picture).exists()
+
+# Test conditional GETs: unchanged feed/detail loads get a 304, writes change the ETag
+def test_feed_and_event_etags(client: TestClient, create_test_user, db):
+    host = create_test_user("host@example.com", "password123")
+    guest = create_test_user("guest@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+    event_data = {
+        "title": "Cached Event",
+        "description": "This is a test event",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Test Location",
+        "public": True
+    }
+    client.post("/events/create_event", data=event_data, follow_redirects=False)
+    event = db.query(Event).filter(Event.title == "Cached Event").one()
+    # Storing the generated tags is a write too; let it land first
+    wait_for_tags(client, event.id)
+
+    feed = client.get("/events/partial")
+    detail = client.get(f"/events/{event.id}")
+    assert feed.headers["cache-control"] == "private, no-cache"
+    assert client.get("/events/partial", headers={"If-None-Match": feed.headers["etag"]}).status_code == 304
+    assert client.get(f"/events/{event.id}", headers={"If-None-Match": detail.headers["etag"]}).status_code == 304
+    # ETags are per viewer
+    client.cookies.set("access_token", create_access_token(data={"user_id": guest.id}))
+    assert client.get("/events/partial", headers={"If-None-Match": feed.headers["etag"]}).status_code == 200
+
+    client.post(f"/attend/{event.id}/join")
+    client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+    response = client.get("/events/partial", headers={"If-None-Match": feed.headers["etag"]})
+    assert response.status_code == 200
+    assert "Number of Participants: 2" in BeautifulSoup(response.text, "html.parser").get_text()
+    response = client.get(f"/events/{event.id}", headers={"If-None-Match": detail.headers["etag"]})
+    assert response.status_code == 200
+    assert "guest@example.com" in response.text
+
+# Test that versions are scoped: a write to an event that is not on the page keeps the feed's ETag
+def test_feed_etag_ignores_events_not_shown(client: TestClient, create_test_user, db, monkeypatch):
+    host = create_test_user("host@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+    monkeypatch.setattr(settings, "events_page_size", 1)
+    for day, title in enumerate(["First", "Second", "Third", "Fourth"], start=1):
+        client.post("/events/create_event", data={
+            "title": title,
+            "description": "This is a test event",
+            "event_time": (datetime.utcnow() + timedelta(days=day)).isoformat(),
+            "location": "Test Location",
+            "public": True
+        }, follow_redirects=False)
+    events = {event.title: event for event in db.query(Event).all()}
+    for event in events.values():
+        wait_for_tags(client, event.id)
+
+    # The first page shows "First"; the top events are the first three
+    feed = client.get("/events/partial")
+    detail = client.get(f"/events/{events['First'].id}")
+    client.post(f"/attend/{events['Fourth'].id}/leave")
+    assert client.get("/events/partial", headers={"If-None-Match": feed.headers["etag"]}).status_code == 304
+    assert client.get(f"/events/{events['First'].id}", headers={"If-None-Match": detail.headers["etag"]}).status_code == 304
+    assert db.execute(text("SELECT count(*) FROM content_versions WHERE key = 'feed'")).scalar() == 0
+
+    client.post(f"/attend/{events['Second'].id}/leave")
+    assert client.get("/events/partial", headers={"If-None-Match": feed.headers["etag"]}).status_code == 200
+
+# Test the fragment cache: viewers with the same attended set share cards, writes invalidate
+def test_feed_fragment_cache(client: TestClient, create_test_user, db):
+    host = create_test_user("host@example.com", "password123")
+    anna = create_test_user("anna@example.com", "password123")
+    bob = create_test_user("bob@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+    event_data = {
+        "title": "Fragment Event",
+        "description": "This is a test event",
+        "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        "location": "Test Location",
+        "public": True
+    }
+    client.post("/events/create_event", data=event_data, follow_redirects=False)
+    event = db.query(Event).filter(Event.title == "Fragment Event").one()
+    wait_for_tags(client, event.id)
+
+    def kinds():
+        return client.get("/fragments/stats").json()["kinds"]
+
+    client.cookies.set("access_token", create_access_token(data={"user_id": anna.id}))
+    client.get("/events/partial")
+    before = kinds()
+    client.cookies.set("access_token", create_access_token(data={"user_id": bob.id}))
+    response = client.get("/events/partial")
+    after = kinds()
+    assert after["event_card"]["hits"] == before["event_card"]["hits"] + 1
+    assert after["top_events"]["hits"] == before["top_events"]["hits"] + 1
+    assert after["event_card"]["render_ms_saved"] > 0
+    assert "Fragment Event" in response.text
+
+    # Bob joins: that one card and the top events are rebuilt with the new count
+    client.post(f"/attend/{event.id}/join")
+    response = client.get("/events/partial")
+    assert kinds()["event_card"]["misses"] == after["event_card"]["misses"] + 1
+    soup = BeautifulSoup(response.text, "html.parser")
+    assert soup.find(id=f"participants-{event.id}").text == "2"
+    assert "Leave" in soup.find(id="events-list").get_text()
+
+    response = client.get(f"/events/{event.id}")
+    assert "bob@example.com" in response.text
+    client.get(f"/events/{event.id}")
+    assert kinds()["event_detail"]["hits"] >= 1
+
+# Test that a join only re-renders the card it changed; the rest of the page stays cached
+def test_feed_cards_cached_per_event(client: TestClient, create_test_user, db):
+    host = create_test_user("host@example.com", "password123")
+    guest = create_test_user("guest@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+    for day in range(1, 6):
+        client.post("/events/create_event", data={
+            "title": f"Card {day}",
+            "description": "This is a test event",
+            "event_time": (datetime.utcnow() + timedelta(days=day)).isoformat(),
+            "location": "Test Location",
+            "public": True
+        }, follow_redirects=False)
+    events = db.query(Event).order_by(Event.event_time).all()
+    for event in events:
+        wait_for_tags(client, event.id)
+
+    def cards():
+        return client.get("/fragments/stats").json()["kinds"]["event_card"]
+
+    client.cookies.set("access_token", create_access_token(data={"user_id": guest.id}))
+    start = cards()
+    client.get("/events/partial")
+    for event in events:
+        before = cards()
+        client.post(f"/attend/{event.id}/join")
+        response = client.get("/events/partial")
+        after = cards()
+        assert after["misses"] == before["misses"] + 1
+        assert after["hits"] == before["hits"] + len(events) - 1
+        assert BeautifulSoup(response.text, "html.parser").find(id=f"participants-{event.id}").text == "2"
+    end = cards()
+    # 5 first renders, then 1 render and 4 hits per join
+    assert (end["hits"] - start["hits"], end["misses"] - start["misses"]) == (20, 10)
+
+# Test live feed updates: joins push the new count, new events reach public feeds and private invitees only
+def test_feed_live_updates(client: TestClient, create_test_user, db):
+    host = create_test_user("host@example.com", "password123")
+    guest = create_test_user("guest@example.com", "password123")
+    outsider = create_test_user("outsider@example.com", "password123")
+    guest_feed = feed_updates.subscribe(guest.id)
+    outsider_feed = feed_updates.subscribe(outsider.id)
+
+    def received(queue, count):
+        # create_event publishes from the threadpool, so give the loop a moment
+        for _ in range(50):
+            if queue.qsize() >= count:
+                break
+            time.sleep(0.05)
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    try:
+        client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+        event_data = {
+            "title": "Live Event",
+            "description": "This is a test event",
+            "event_time": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+            "location": "Test Location",
+            "public": True
+        }
+        client.post("/events/create_event", data=event_data, follow_redirects=False)
+        event = db.query(Event).filter(Event.title == "Live Event").one()
+        for queue in (guest_feed, outsider_feed):
+            assert received(queue, 1) == [{"type": "new_event", "event_id": event.id, "public": True}]
+
+        client.post("/events/create_event", data={**event_data, "title": "Private Live Event", "public": False, "invitees": ["guest@example.com"]}, follow_redirects=False)
+        private_event = db.query(Event).filter(Event.title == "Private Live Event").one()
+        assert [message["event_id"] for message in received(guest_feed, 1)] == [private_event.id]
+        assert received(outsider_feed, 0) == []
+
+        client.cookies.set("access_token", create_access_token(data={"user_id": guest.id}))
+        client.post(f"/attend/{event.id}/join")
+        client.post(f"/attend/{event.id}/join")
+        expected = [{"type": "participants", "event_id": event.id, "count": 2, "delta": 1}]
+        assert received(outsider_feed, 1) == expected
+        client.post(f"/attend/{event.id}/leave")
+        assert received(outsider_feed, 1) == [{"type": "participants", "event_id": event.id, "count": 1, "delta": -1}]
+        received(guest_feed, 3)
+
+        # Counts of a private event only reach its invitees
+        client.post(f"/attend/{private_event.id}/join")
+        assert [(message["type"], message["count"]) for message in received(guest_feed, 1)] == [("participants", 2)]
+        assert received(outsider_feed, 0) == []
+        client.cookies.set("access_token", create_access_token(data={"user_id": host.id}))
+        client.post(f"/events/{private_event.id}/attendees/import", json={"emails": ["outsider@example.com"]})
+        # Importing an attendee invites them, so from then on they are in the audience
+        assert [message["count"] for message in received(outsider_feed, 1)] == [3]
+        assert client.get("/ws/stats").json()["feed_updates"]["subscribers"] >= 2
+
+        # The new-events banner reloads the feed the viewer is on
+        response = client.get("/events/partial", params={"event_type": "invited", "search_query": "live music"})
+        banner = BeautifulSoup(response.text, "html.parser").find(id="new-events-banner")
+        assert banner["hx-get"] == "/events/partial?event_type=invited&search_query=live+music"
+    finally:
+        feed_updates.unsubscribe(guest_feed)
+        feed_updates.unsubscribe(outsider_feed)
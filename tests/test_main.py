@@ -1,6 +1,16 @@
 from bs4 import BeautifulSoup
 from fastapi.testclient import TestClient
 from app.oauth2 import create_access_token
+from app.models import User
+from app.hashing import password_hasher
+from app import compression, utils
+from app.chat import ConnectionManager, ensure_chat_schema
+from app.pubsub import get_pubsub_backend, PostgresPubSub
+from passlib.context import CryptContext
+from tests.conftest import TEST_SQLALCHEMY_DATABASE_URL, test_engine
+from sqlalchemy import text
+import asyncio
+import json
 import pytest
 
 def test_get_general_profile(client, create_test_user):
@@ -39,3 +49,229 @@ def test_user_chatrooms(client, create_test_user):
     print(f"Response status: {response.status_code}")
     print(f"Response body: {response.text}")
     assert response.status_code == 200
+
+def test_websocket_stats(client):
+    response = client.get("/ws/stats")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_connections"] == 0
+    assert "rooms" in data
+
+def test_memory_pubsub_routes_to_subscriber():
+    async def scenario():
+        backend = get_pubsub_backend("memory")
+        received = []
+        await backend.subscribe(1, lambda event_id, payload: received.append((event_id, payload)))
+        await backend.publish(1, "first")
+        await backend.publish(2, "other event")
+        await backend.unsubscribe(1)
+        await backend.publish(1, "after unsubscribe")
+        return received
+    assert asyncio.run(scenario()) == [(1, "first")]
+
+def test_postgres_pubsub_round_trip():
+    async def wait_for(received, count):
+        for _ in range(100):
+            if len(received) >= count:
+                return
+            await asyncio.sleep(0.02)
+
+    async def scenario():
+        backend = PostgresPubSub(dsn=TEST_SQLALCHEMY_DATABASE_URL, channel_prefix="test_pubsub_")
+        received = []
+        try:
+            await backend.subscribe(7, lambda event_id, payload: received.append((event_id, payload)))
+            await backend.publish(7, json.dumps({"content": "hello"}))
+            await wait_for(received, 1)
+            # Over the NOTIFY limit: dropped instead of failing the publisher
+            await backend.publish(7, "x" * 8000)
+            await backend.publish(7, json.dumps({"content": "after"}))
+            await wait_for(received, 2)
+            await backend.unsubscribe(7)
+            await backend.publish(7, json.dumps({"content": "unsubscribed"}))
+            await asyncio.sleep(0.2)
+        finally:
+            await backend.close()
+        return received
+    assert asyncio.run(scenario()) == [(7, '{"content": "hello"}'), (7, '{"content": "after"}')]
+
+class FakeWebSocket:
+    # Records what it is sent; a slow one never finishes a send, so its queue fills up
+    def __init__(self, name, slow=False):
+        self.client = name
+        self.slow = slow
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.slow:
+            await asyncio.Event().wait()
+        self.sent.append(json.loads(text)["n"])
+
+    async def close(self, code):
+        self.close_code = code
+
+def run_slow_consumer(policy):
+    async def scenario():
+        manager = ConnectionManager(get_pubsub_backend("memory"), max_queue_size=2, slow_consumer_policy=policy)
+        fast, slow, other_room = FakeWebSocket("fast"), FakeWebSocket("slow", slow=True), FakeWebSocket("other")
+        await manager.connect(fast, 1)
+        await manager.connect(slow, 1)
+        await manager.connect(other_room, 2)
+        for n in range(5):
+            await manager.broadcast(1, {"n": n})
+            await asyncio.sleep(0.01)
+        stats = manager.stats()
+        for websocket, event_id in ((fast, 1), (slow, 1), (other_room, 2)):
+            manager.disconnect(websocket, event_id)
+        await asyncio.sleep(0.01)
+        return fast, slow, other_room, stats
+    return asyncio.run(scenario())
+
+def test_slow_consumer_drop_policy():
+    fast, slow, other_room, stats = run_slow_consumer("drop")
+    assert fast.sent == [0, 1, 2, 3, 4]
+    assert other_room.sent == []
+    # The slow socket is stuck sending 0; its queue keeps only the newest two frames
+    assert stats["rooms"][1] == {"connections": 2, "queue_depths": [0, 2]}
+    assert stats["dropped_messages"] == 2
+    assert slow.close_code is None
+
+def test_slow_consumer_disconnect_policy():
+    fast, slow, other_room, stats = run_slow_consumer("disconnect")
+    assert fast.sent == [0, 1, 2, 3, 4]
+    assert other_room.sent == []
+    assert stats["rooms"][1]["connections"] == 1
+    assert stats["rooms"][2]["connections"] == 1
+    assert stats["slow_consumers_disconnected"] == 1
+    assert stats["dropped_messages"] == 0
+    assert slow.close_code == 1013
+
+def test_user_cache_invalidated_on_profile_update(client, create_test_user):
+    user = create_test_user("testuser@example.com", "password123")
+    cookies = {"access_token": create_access_token(data={"user_id": user.id})}
+    before = client.get("/auth/stats").json()["user_cache"]
+
+    client.get("/chatrooms", cookies=cookies)
+    client.get("/chatrooms", cookies=cookies)
+    stats = client.get("/auth/stats").json()["user_cache"]
+    assert stats["db_queries_saved"] == before["db_queries_saved"] + 1
+    assert stats["size"] == 1
+
+    response = client.post(f"/{user.id}/update", data={"bio": "New bio", "school": "New school"}, cookies=cookies)
+    assert response.status_code == 200
+    stats = client.get("/auth/stats").json()["user_cache"]
+    assert stats["invalidations"] == before["invalidations"] + 1
+    assert stats["size"] == 0
+
+def test_verified_token_cache(client, create_test_user):
+    user = create_test_user("testuser@example.com", "password123")
+    token = create_access_token(data={"user_id": user.id})
+    before = client.get("/auth/stats").json()["token_cache"]
+
+    assert client.get("/chatrooms", cookies={"access_token": token}).status_code == 200
+    assert client.get("/chatrooms", cookies={"access_token": token}).status_code == 200
+    stats = client.get("/auth/stats").json()["token_cache"]
+    assert stats["hits"] == before["hits"] + 1
+    assert stats["size"] == 1
+
+    # A tampered token is still rejected and never cached
+    assert client.get("/chatrooms", cookies={"access_token": token[:-2] + "xx"}).status_code == 401
+    assert client.get("/auth/stats").json()["token_cache"]["size"] == 1
+
+def test_login_rehashes_outdated_password(client, create_test_user, db):
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("password123")
+    user = create_test_user("testuser@example.com", old_hash)
+
+    response = client.post("/login", data={"username": "testuser@example.com", "password": "password123"})
+    assert response.status_code == 200
+    db.refresh(user)
+    assert user.password != old_hash
+    assert not utils.pwd_context.needs_update(user.password)
+
+    response = client.post("/login", data={"username": "testuser@example.com", "password": "wrong"})
+    assert response.status_code == 403
+    assert client.get("/auth/stats").json()["password_hasher"]["rehashed"] >= 1
+
+def test_login_rejected_when_hashing_overloaded(client, create_test_user, monkeypatch):
+    create_test_user("testuser@example.com", utils.hash("password123"))
+    monkeypatch.setattr(password_hasher, "max_pending", 0)
+
+    response = client.post("/login", data={"username": "testuser@example.com", "password": "password123"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+def test_signup_hashes_in_pool_and_sheds_load(client, db, monkeypatch):
+    form = {"email": "newuser@example.com", "password": "password123", "birthday": "2000-01-01"}
+    response = client.post("/users/", data=form)
+    assert response.status_code == 201
+    user = db.query(User).filter(User.email == "newuser@example.com").one()
+    assert utils.verify("password123", user.password)
+    assert client.post("/users/", data=form).status_code == 409
+
+    monkeypatch.setattr(password_hasher, "max_pending", 0)
+    response = client.post("/users/", data={**form, "email": "another@example.com"})
+    assert response.status_code == 429
+    assert "sign-ups" in response.text
+
+def test_database_stats(client):
+    response = client.get("/db/stats")
+    assert response.status_code == 200
+    data = response.json()
+    # The startup summary backfill goes through the app's own sync engine
+    assert data["sync"]["checkouts"] >= 1
+    assert data["sync"]["connections_opened"] >= 1
+    assert 0.0 <= data["sync"]["saturation"] <= 1.0
+    assert data["async"]["timeouts"] == 0
+
+def test_search_users(client, create_test_user):
+    user = create_test_user("testuser@example.com", "password123")
+    for email in ["bob@example.com", "bobby@example.com", "alice@example.com"]:
+        create_test_user(email, "password123")
+    cookies = {"access_token": create_access_token(data={"user_id": user.id})}
+
+    def options(response):
+        soup = BeautifulSoup(response.content, "html.parser")
+        return [(checkbox["value"], checkbox.has_attr("checked")) for checkbox in soup.find_all("input", {"name": "invitees"})]
+
+    response = client.get("/users/search", params={"q": "Bob"}, cookies=cookies)
+    assert response.status_code == 200
+    assert options(response) == [("bob@example.com", False), ("bobby@example.com", False)]
+
+    # Already ticked emails stay ticked and are not repeated in the matches
+    response = client.get("/users/search", params={"q": "bob", "invitees": "bob@example.com"}, cookies=cookies)
+    assert options(response) == [("bob@example.com", True), ("bobby@example.com", False)]
+
+    # The current user and LIKE wildcards never match
+    assert options(client.get("/users/search", params={"q": "test"}, cookies=cookies)) == []
+    assert options(client.get("/users/search", params={"q": "%"}, cookies=cookies)) == []
+
+# Test response compression: brotli/gzip above the threshold, small bodies untouched
+def test_response_compression(client, create_test_user):
+    user = create_test_user("testuser@example.com", "password123")
+    client.cookies.set("access_token", create_access_token(data={"user_id": user.id}))
+
+    response = client.get("/events/partial", headers={"Accept-Encoding": "br, gzip"})
+    # brotli is optional; without it the same request falls back to gzip
+    assert response.headers["content-encoding"] == ("gzip" if compression.brotli is None else "br")
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert "Events" in response.text
+
+    response = client.get("/events/partial", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) < len(response.content)
+
+    response = client.get("/compression/stats", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.json()["compressed"] >= 2
+
+def test_chat_history_index_added_to_existing_table(db):
+    db.execute(text("DROP INDEX ix_messages_event_id_timestamp_id"))
+    db.commit()
+    ensure_chat_schema(test_engine)
+    ensure_chat_schema(test_engine)
+    indexes = db.execute(text("SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_messages_event_id_timestamp_id'")).scalars().all()
+    assert indexes == ["CREATE INDEX ix_messages_event_id_timestamp_id ON public.messages USING btree (event_id, \"timestamp\", id)"]